@@ -72,7 +72,7 @@ class AIInteractionRequest(BaseModel):
     
     interaction_id: Optional[str] = Field(
         default=None,
-        description="Existing interaction ID when updating with feedback",
+        description="Existing interaction ID when updating with feedback, or a pre-assigned ID for a new interaction",
         examples=["req_550e8400-e29b-41d4-a716-446655440000"]
     )
     
@@ -186,8 +186,9 @@ class AIInteractionService:
                 # Update existing interaction with feedback
                 return self._update_interaction_with_feedback(interaction_request)
             
-            # Create new interaction tracking
-            interaction_id = f"req_{uuid.uuid4()}"
+            # Create new interaction tracking (callers that track in the background
+            # pre-assign the ID so they can return it before the record exists)
+            interaction_id = interaction_request.interaction_id or f"req_{uuid.uuid4()}"
             timestamp = datetime.now(timezone.utc)
             
             logger.info(f"📝 Processing AI interaction for service: {interaction_request.service_name}")
@@ -26,6 +26,13 @@ INDEX_MAPPING = {
     "staff": OPENSEARCH_INDEX
 }
 
+# The validation prompts never change, so they are JSON-escaped and encoded once;
+# only the per-entry candidates text is serialised on each LLM call.
+PROMPT_PAYLOAD_PREFIXES = {
+    "staff": b'{"prompt": ' + json.dumps(prompt_staff).encode("utf-8") + b', "input_text": ',
+    "institution": b'{"prompt": ' + json.dumps(prompt_institutions).encode("utf-8") + b', "input_text": '
+}
+
 
 def call_llm_validation(original_value: str, candidates: List[Dict], entry_type: str) -> Optional[Dict]:
     """Call the LLM API to validate and select the best candidate"""
@@ -46,19 +53,17 @@ def call_llm_validation(original_value: str, candidates: List[Dict], entry_type:
                 candidates_text += f"   Website: {candidate.get('website', 'N/A')}\n"
                 candidates_text += f"   OpenSearch Score: {candidate['score']}\n\n"
         
-        if entry_type == "staff":
-            prompt = prompt_staff
-        else:
-            prompt = prompt_institutions
-
-        payload = {
-            "prompt": prompt,
-            "input_text": candidates_text
-        }
+        payload_prefix = PROMPT_PAYLOAD_PREFIXES["staff" if entry_type == "staff" else "institution"]
+        payload = b"".join((payload_prefix, json.dumps(candidates_text).encode("utf-8"), b"}"))
         
         logger.info(f"🤖 Calling LLM for validation of {len(candidates)} candidates...")
         
-        response = requests.post(LLM_API_URL, json=payload, timeout=300)
+        response = requests.post(
+            LLM_API_URL,
+            data=payload,
+            headers={"Content-Type": "application/json"},
+            timeout=300
+        )
         response.raise_for_status()
         
         llm_response = response.text.strip()
@@ -39,6 +39,23 @@ def main():
         choices=["debug", "info", "warning", "error", "critical"],
         help="Log level (default: info)"
     )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=os.cpu_count() or 1,
+        help="Number of worker processes, ignored with --reload (default: number of CPUs)"
+    )
+    parser.add_argument(
+        "--access-log",
+        action="store_true",
+        help="Enable uvicorn access logs (disabled by default)"
+    )
+    parser.add_argument(
+        "--limit-concurrency",
+        type=int,
+        default=512,
+        help="Maximum concurrent connections per worker before returning 503 (default: 512)"
+    )
     
     args = parser.parse_args()
 
@@ -53,6 +70,11 @@ def main():
         host=args.host,
         port=args.port,
         reload=args.reload,
+        workers=1 if args.reload else args.workers,
+        loop="uvloop",
+        http="httptools",
+        access_log=args.access_log,
+        limit_concurrency=args.limit_concurrency,
         log_level=args.log_level
     )
 
@@ -1,14 +1,25 @@
 """FastAPI application for PRMS QA Service."""
 
 from fastapi import FastAPI
+from contextlib import asynccontextmanager
 from app.api.routes import router
 from fastapi.responses import JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
+from app.utils.config.config_util import CORS_ORIGINS
 from app.utils.logger.logger_util import get_logger
+from app.utils.interactions.interaction_client import interaction_client
 
 logger = get_logger()
 
+
+@asynccontextmanager
+async def lifespan(app):
+    yield
+    await interaction_client.close()
+
+
 app = FastAPI(
+    lifespan=lifespan,
     title="PRMS QA API",
     description="""
     🔍 PRMS QA Service
@@ -54,10 +65,10 @@ app = FastAPI(
 
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=["*"],
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
+    allow_origins=CORS_ORIGINS,
+    allow_methods=["GET", "POST"],
+    allow_headers=["Content-Type", "Authorization"],
+    max_age=3600,
 )
 
 app.include_router(router)
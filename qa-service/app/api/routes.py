@@ -1,14 +1,21 @@
 """REST API endpoints for PRMS QA Service."""
 
+import asyncio
 import traceback
-from app.utils.logger.logger_util import get_logger
-from fastapi import APIRouter, HTTPException, status
+from app.utils.logger.logger_util import get_logger, log_sampled_traceback
 from app.llm.mining import improve_prms_result_metadata
+from app.utils.config.config_util import BEDROCK_MAX_INFLIGHT
+from fastapi import APIRouter, BackgroundTasks, HTTPException, status
+from app.utils.interactions.interaction_client import interaction_client
 from app.api.models import PrmsRequest, PrmsResponse, ErrorResponse
 
 logger = get_logger()
 router = APIRouter()
 
+# Admission control for Bedrock: excess requests wait here instead of all
+# hitting Bedrock at once and amplifying throttling retries.
+bedrock_semaphore = asyncio.Semaphore(BEDROCK_MAX_INFLIGHT)
+
 @router.post(
     "/api/prms-qa",
     response_model=PrmsResponse,
@@ -84,16 +91,26 @@ router = APIRouter()
         }
     }
 )
-async def prms_qa(request: PrmsRequest) -> PrmsResponse:
+async def prms_qa(request: PrmsRequest, background_tasks: BackgroundTasks) -> PrmsResponse:
     """
     Process PRMS result metadata using an LLM.
     - result_metadata: JSON dict with PRMS result details.
     - user_id: Optional user ID for tracking.
+
+    Interaction tracking runs as a background task after the response is sent.
     """
     try:
         logger.info(f"🔍 Processing PRMS QA for user: {request.user_id}")
         
-        result = improve_prms_result_metadata(request.result_metadata, request.user_id)
+        if bedrock_semaphore.locked():
+            logger.warning(f"⏳ Bedrock concurrency limit ({BEDROCK_MAX_INFLIGHT}) reached, request queued")
+
+        async with bedrock_semaphore:
+            result = await asyncio.to_thread(improve_prms_result_metadata, request.result_metadata, request.user_id)
+
+        if "interaction" in result:
+            background_tasks.add_task(interaction_client.track_interaction_async, **result["interaction"])
+
         return PrmsResponse(
             time_taken=result["time_taken"],
             json_content=result["json_content"],
@@ -120,7 +137,7 @@ async def prms_qa(request: PrmsRequest) -> PrmsResponse:
     except Exception as e:
         logger.error(f"Unexpected error: {str(e)}")
         tb = traceback.format_exc()
-        logger.error(f"📋 Full traceback:\n{tb}")
+        log_sampled_traceback()
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail={
@@ -1,26 +1,33 @@
 import time
 import json
+import uuid
 import boto3
-import traceback
-from app.utils.config.config_util import AWS
+import orjson
+import logging
+from botocore.config import Config
 from app.utils.prompt.prompt import build_prompt
-from app.utils.logger.logger_util import get_logger
-from app.utils.s3.s3_util import read_document_from_s3
-from app.utils.interactions.interaction_client import interaction_client
+from app.utils.logger.logger_util import get_logger, log_sampled_traceback
 
 
 logger = get_logger()
 
 bedrock_runtime = boto3.client(
     service_name='bedrock-runtime',
-    region_name='us-east-1'
+    region_name='us-east-1',
+    config=Config(
+        max_pool_connections=64,
+        retries={'max_attempts': 3, 'mode': 'adaptive'},
+        connect_timeout=5,
+        read_timeout=120,
+        tcp_keepalive=True
+    )
 )
 
 
 def invoke_model(prompt, max_tokens=2000):
     try:
         logger.info("🚀 Invoking the model...")
-        request_body = {
+        request_body = orjson.dumps({
             "anthropic_version": "bedrock-2023-05-31",
             "max_tokens": max_tokens,
             "temperature": 0.1,
@@ -31,31 +38,30 @@ def invoke_model(prompt, max_tokens=2000):
                 {
                     "role": "user",
                     "content": [
-                        {"type": "text", "text": f"{prompt}"}
+                        {"type": "text", "text": prompt}
                     ]
                 }
             ]
-        }
+        })
         response = bedrock_runtime.invoke_model(
             modelId="us.anthropic.claude-sonnet-4-20250514-v1:0",
-            body=json.dumps(request_body),
+            body=request_body,
             contentType="application/json",
             accept="application/json"
         )
-        return json.loads(response['body'].read())['content'][0]['text']
+        return orjson.loads(response['body'].read())['content'][0]['text']
 
     except Exception as e:
         logger.error(f"❌ Error invoking the model: {str(e)}")
         raise
 
 
-def is_valid_json(text):
-    """Check if the text is a valid JSON string"""
+def parse_or_wrap(text):
+    """Parse the text as JSON, or wrap it as {"text": ...} if it is not valid JSON"""
     try:
-        json.loads(text)
-        return True
-    except json.JSONDecodeError:
-        return False
+        return orjson.loads(text)
+    except orjson.JSONDecodeError:
+        return {"text": text}
 
 
 def improve_prms_result_metadata(result_metadata: dict, user_id: str = None):
@@ -70,49 +76,18 @@ def improve_prms_result_metadata(result_metadata: dict, user_id: str = None):
         logger.info(f"🔍 Processing PRMS document with result type: {result_type}, result level: {result_level}")
         
         prompt = build_prompt(result_type, result_level, result_metadata)
-        logger.info(f"📝 Generated prompt for LLM:\n{prompt}")
+        logger.debug("📝 Generated prompt for LLM:\n%s", prompt)
 
         response_text = invoke_model(prompt)
 
-        json_content = json.loads(response_text) if is_valid_json(response_text) else {"text": response_text}
+        json_content = parse_or_wrap(response_text)
 
         end_time = time.time()
         elapsed_time = end_time - start_time
 
-        interaction_id = None
-        if user_id:
-            try:           
-                ai_output = json.dumps(json_content, indent=2, ensure_ascii=False)
-                user_input = f"PRMS Result Metadata - Result type: {result_type}, Original result title: {result_title}, Original result description: {result_description}"
-
-                tracking_context = {
-                    "prompt_used": prompt[:500] + "..." if len(prompt) > 500 else prompt,
-                    "prompt_full_length": len(prompt),
-                    "model_used": "claude-4-sonnet"
-                }
-                
-                interaction_response = interaction_client.track_interaction(
-                    user_id=user_id,
-                    user_input=user_input,
-                    ai_output=ai_output,
-                    service_name="qa-ai",
-                    display_name="PRMS Reporting Tool - QA Service",
-                    service_description="A service that provides QA capabilities for documents.",
-                    context=tracking_context,
-                    response_time_seconds=elapsed_time,
-                    platform="PRMS"
-                )
-
-                if interaction_response:
-                    interaction_id = interaction_response.get('interaction_id')
-                    logger.info(f"📊 Interaction tracked with ID: {interaction_id}")
-                else:
-                    logger.warning("⚠️ Failed to track interaction with interaction service")
-
-            except Exception as tracking_error:
-                logger.error(f"❌ Error tracking interaction: {str(tracking_error)}")
-        
-        logger.info(f"✅ Successfully generated PRMS response:\n{json.dumps(json_content, indent=2, ensure_ascii=False)}")
+        logger.info("✅ Successfully generated PRMS response")
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("📦 PRMS response content:\n%s", json.dumps(json_content, indent=2, ensure_ascii=False))
         logger.info(f"⏱️ PRMS Response time: {elapsed_time:.2f} seconds")
 
         result = {
@@ -120,19 +95,36 @@ def improve_prms_result_metadata(result_metadata: dict, user_id: str = None):
             "json_content": json_content,
         }
 
-        if interaction_id:
+        if user_id:
+            interaction_id = f"req_{uuid.uuid4()}"
             result["interaction_id"] = interaction_id
+            result["interaction"] = {
+                "interaction_id": interaction_id,
+                "user_id": user_id,
+                "user_input": f"PRMS Result Metadata - Result type: {result_type}, Original result title: {result_title}, Original result description: {result_description}",
+                "ai_output": orjson.dumps(json_content, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS).decode(),
+                "service_name": "qa-ai",
+                "display_name": "PRMS Reporting Tool - QA Service",
+                "service_description": "A service that provides QA capabilities for documents.",
+                "context": {
+                    "prompt_used": prompt[:500] + "..." if len(prompt) > 500 else prompt,
+                    "prompt_full_length": len(prompt),
+                    "model_used": "claude-4-sonnet"
+                },
+                "response_time_seconds": elapsed_time,
+                "platform": "PRMS"
+            }
         
         return result
 
     except KeyError as e:
         logger.error(f"❌ PRMS KeyError - Missing key: {str(e)}")
         logger.error(f"📦 DEBUG - Available keys: {list(result_metadata.keys())}")
-        logger.error(f"📋 Full traceback:\n{traceback.format_exc()}")
+        log_sampled_traceback()
         raise ValueError(f"Missing required field: {str(e)}")
     
     except Exception as e:
         logger.error(f"❌ PRMS Error: {str(e)}")
         logger.error(f"📦 DEBUG - Error type: {type(e).__name__}")
-        logger.error(f"📋 Full traceback:\n{traceback.format_exc()}")
+        log_sampled_traceback()
         raise
\ No newline at end of file
@@ -5,4 +5,8 @@ load_dotenv()
 
 AWS = {
     "aws_region": os.getenv("AWS_REGION", "us-east-1")
-}
\ No newline at end of file
+}
+
+CORS_ORIGINS = [origin.strip() for origin in os.getenv("CORS_ORIGINS", "*").split(",") if origin.strip()]
+
+BEDROCK_MAX_INFLIGHT = int(os.getenv("BEDROCK_MAX_INFLIGHT", "16"))
@@ -1,4 +1,8 @@
+import ssl
 import json
+import asyncio
+import certifi
+import aiohttp
 import requests
 from typing import Dict, Any, Optional
 from app.utils.logger.logger_util import get_logger
@@ -6,12 +10,38 @@ from app.utils.logger.logger_util import get_logger
 logger = get_logger()
 
 INTERACTION_SERVICE_URL = "https://i8s5i8c21i.execute-api.us-east-1.amazonaws.com"
+MAX_INFLIGHT_TRACKING = 32
+
+_tracking_semaphore = asyncio.Semaphore(MAX_INFLIGHT_TRACKING)
 
 class InteractionClient:
     """Client for interacting with the external interaction service."""
     
     def __init__(self, base_url: str = INTERACTION_SERVICE_URL):
         self.base_url = base_url.rstrip('/')
+        self._session = None
+        self._session_loop = None
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        """
+        Shared session for background tracking, created on first use in the running
+        event loop, so connections (and their TLS handshakes) are reused across calls.
+        """
+        loop = asyncio.get_running_loop()
+        if self._session is None or self._session.closed or self._session_loop is not loop:
+            ssl_context = ssl.create_default_context(cafile=certifi.where())
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(ssl=ssl_context),
+                timeout=aiohttp.ClientTimeout(total=10)
+            )
+            self._session_loop = loop
+        return self._session
+
+    async def close(self):
+        """Close the shared tracking session, e.g. on application shutdown"""
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
         
     def track_interaction(
         self,
@@ -88,5 +118,73 @@ class InteractionClient:
             logger.error(f"❌ Unexpected error while tracking interaction: {str(e)}")
             return None
 
+    async def track_interaction_async(
+        self,
+        user_id: str,
+        user_input: Optional[str],
+        ai_output: Optional[str],
+        interaction_id: Optional[str] = None,
+        service_name: str = "text-mining",
+        display_name: Optional[str] = None,
+        service_description: Optional[str] = None,
+        context: Optional[Dict[str, Any]] = None,
+        response_time_seconds: Optional[float] = None,
+        platform: str = "STAR"
+    ) -> Optional[Dict[str, Any]]:
+        """
+        Track an AI interaction without blocking the caller's response.
+
+        Meant to be scheduled as a background task once the response has been
+        built. The number of in-flight tracking requests is bounded so a burst
+        of traffic cannot pile up unbounded connections to the service.
+
+        Args:
+            interaction_id: Pre-assigned interaction ID already returned to the caller
+            (remaining arguments as in track_interaction)
+
+        Returns:
+            Response from feedback service or None if failed
+        """
+        try:
+            payload = {
+                "user_id": user_id,
+                "interaction_id": interaction_id,
+                "ai_output": ai_output,
+                "service_name": service_name,
+                "display_name": display_name,
+                "service_description": service_description,
+                "context": context or {},
+                "response_time_seconds": response_time_seconds,
+                "platform": platform
+            }
+
+            if user_input:
+                payload["user_input"] = user_input
+
+            payload = {k: v for k, v in payload.items() if v is not None}
+
+            logger.info(f"📝 Tracking interaction in background for service: {service_name}")
+
+            async with _tracking_semaphore:
+                session = self._get_session()
+                async with session.post(f"{self.base_url}/api/interactions", json=payload) as response:
+                    if response.status == 200:
+                        result = await response.json()
+                        logger.info(f"✅ Interaction tracked successfully: {result.get('interaction_id')}")
+                        return result
+
+                    logger.error(f"❌ Failed to track interaction: {response.status} - {await response.text()}")
+                    return None
+
+        except asyncio.TimeoutError:
+            logger.error("⏰ Timeout while tracking interaction")
+            return None
+        except aiohttp.ClientError as e:
+            logger.error(f"🌐 Network error while tracking interaction: {str(e)}")
+            return None
+        except Exception as e:
+            logger.error(f"❌ Unexpected error while tracking interaction: {str(e)}")
+            return None
+
 
 interaction_client = InteractionClient()
\ No newline at end of file
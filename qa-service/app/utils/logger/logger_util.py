@@ -1,6 +1,8 @@
 import os
 import sys
+import random
 import logging
+import traceback
 from pathlib import Path
 from logging.handlers import RotatingFileHandler
 
@@ -10,7 +12,7 @@ logs_dir = Path("/tmp/logs")
 logs_dir.mkdir(parents=True, exist_ok=True)
 
 logger = logging.getLogger("qa-service")
-logger.setLevel(logging.DEBUG)
+logger.setLevel(os.getenv("LOG_LEVEL", "INFO").upper())
 
 log_format = logging.Formatter(
     "%(asctime)s - %(name)s - %(levelname)s - %(filename)s:%(lineno)d - %(message)s"
@@ -29,3 +31,12 @@ logger.addHandler(file_handler)
 
 def get_logger():
     return logger
+
+
+TRACEBACK_SAMPLE_RATE = float(os.getenv("TRACEBACK_SAMPLE_RATE", "0.1"))
+
+
+def log_sampled_traceback():
+    """Log the current traceback for a sample of errors; the caller always logs the message."""
+    if random.random() < TRACEBACK_SAMPLE_RATE:
+        logger.error(f"📋 Full traceback:\n{traceback.format_exc()}")
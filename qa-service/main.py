@@ -4,4 +4,6 @@ from dotenv import load_dotenv
 
 load_dotenv()
 
-handler = Mangum(app)
\ No newline at end of file
+# Mangum would run the lifespan on every invocation, closing the shared tracking
+# session each time; it is kept for the life of the warm environment instead
+handler = Mangum(app, lifespan="off")
\ No newline at end of file
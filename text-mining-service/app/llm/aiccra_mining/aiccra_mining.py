@@ -1,16 +1,18 @@
 import time
-import json
+import uuid
 import boto3
+import orjson
+import logging
 from typing import Dict, Any
 from app.utils.logger.logger_util import get_logger
-from app.utils.s3.s3_util import read_document_from_s3
-from app.utils.config.config_util import AICCRA_BUCKET_KEY_NAME
+from app.utils.s3.s3_util import read_document_from_s3, normalize_document
+from app.utils.tokens.token_util import fit_token_budget
+from app.utils.config.config_util import AICCRA_BUCKET_KEY_NAME, MAX_DOCUMENT_CONTEXT_TOKENS
 from app.utils.prompt.prompt_aiccra import DEFAULT_PROMPT_AICCRA
-from app.utils.interactions.interaction_client import interaction_client
-from app.llm.mining import initialize_reference_data, split_text, invoke_model, is_valid_json
-from app.llm.vectorize import (get_embedding,
+from app.llm.mining import initialize_reference_data, split_text, invoke_model, parse_json_or_none
+from app.llm.vectorize import (get_embeddings_batch,
                                store_temp_embeddings,
-                               get_all_reference_data,
+                               get_reference_text,
                                get_relevant_chunk
                                )
 
@@ -32,44 +34,47 @@ def process_document_aiccra(bucket_name, file_key, prompt, user_id: str = None):
         initialize_reference_data(
             bucket_name, reference_file_regions, reference_file_countries)
 
-        document_content = read_document_from_s3(bucket_name, file_key)
-        chunks = split_text(document_content)
+        doc = normalize_document(read_document_from_s3(bucket_name, file_key))
+        chunks = split_text(doc)
 
         logger.info("#️⃣ Generating embeddings for AICCRA...")
-        embeddings = [get_embedding(chunk) for chunk in chunks]
+        embeddings = get_embeddings_batch(chunks)
 
         db, temp_table_name, document_name = store_temp_embeddings(chunks, embeddings, file_key)
 
-        all_reference_data = get_all_reference_data()
+        reference_text = get_reference_text()
 
-        relevant_chunks = get_relevant_chunk(prompt, db, temp_table_name, document_name)
+        relevant_chunks = fit_token_budget(
+            get_relevant_chunk(prompt, db, temp_table_name, document_name), MAX_DOCUMENT_CONTEXT_TOKENS)
 
-        context = all_reference_data + relevant_chunks
+        query = "".join(("\n".join(relevant_chunks), "\n\nAnswer the question:\n", prompt))
 
-        query = f"""
-        Based on this context:\n{context}\n\n
-        Answer the question:\n{prompt}
-        """
-
-        response_text = invoke_model(query)
-        json_content = json.loads(response_text) if is_valid_json(response_text) else {"text": response_text}
+        response_text = invoke_model(
+            query,
+            cached_prefix="".join(("Based on this context:\n", reference_text, "\n"))
+        )
+        json_content = parse_json_or_none(response_text)
+        if json_content is None:
+            json_content = {"text": response_text}
 
         end_time = time.time()
         elapsed_time = end_time - start_time
 
         interaction_id = None
+        interaction = None
         if user_id:
             try:
                 user_input = f"Document analysis request for: {file_key}"
-                if isinstance(document_content, dict) and document_content.get("type") == "excel":
-                    user_input += f" (Excel file with {len(document_content.get('chunks', []))} rows)"
+                if doc.kind == "excel":
+                    user_input += f" (Excel file with {len(doc.chunks)} rows)"
                 
-                ai_output = json.dumps(json_content, indent=2, ensure_ascii=False)
+                ai_output = orjson.dumps(json_content).decode()
+                prompt_preview = prompt if len(prompt) <= 500 else f"{prompt[:500]}..."
                 
                 tracking_context = {
                     "bucket_name": bucket_name,
                     "file_key": file_key,
-                    "prompt_used": prompt[:500] + "..." if len(prompt) > 500 else prompt,
+                    "prompt_used": prompt_preview,
                     "prompt_full_length": len(prompt),
                     "chunks_processed": len(chunks),
                     "results_count": len(json_content.get("results", [])),
@@ -77,28 +82,28 @@ def process_document_aiccra(bucket_name, file_key, prompt, user_id: str = None):
                     "processing_steps": ["document_read", "text_splitting", "embedding_generation", "vector_search", "llm_processing", "field_mapping"]
                 }
                 
-                interaction_response = interaction_client.track_interaction(
-                    user_id=user_id,
-                    user_input=user_input,
-                    ai_output=ai_output,
-                    service_name="text-mining",
-                    display_name="AICCRA Text Mining Service",
-                    service_description="A service that analyzes documents and extracts insights based on user prompts.",
-                    context=tracking_context,
-                    response_time_seconds=elapsed_time,
-                    platform="AICCRA"
-                )
-
-                if interaction_response:
-                    interaction_id = interaction_response.get('interaction_id')
-                    logger.info(f"📊 Interaction tracked with ID: {interaction_id}")
-                else:
-                    logger.warning("⚠️ Failed to track interaction with interaction service")
+                # Sent by the MCP tool under a pre-assigned ID, before it returns
+                interaction_id = f"req_{uuid.uuid4()}"
+                interaction = {
+                    "interaction_id": interaction_id,
+                    "user_id": user_id,
+                    "user_input": user_input,
+                    "ai_output": ai_output,
+                    "service_name": "text-mining",
+                    "display_name": "AICCRA Text Mining Service",
+                    "service_description": "A service that analyzes documents and extracts insights based on user prompts.",
+                    "context": tracking_context,
+                    "response_time_seconds": elapsed_time,
+                    "platform": "AICCRA"
+                }
+                logger.info(f"📊 Interaction prepared for tracking with ID: {interaction_id}")
 
             except Exception as tracking_error:
                 logger.error(f"❌ Error tracking interaction: {str(tracking_error)}")
         
-        logger.info(f"✅ Successfully generated AICCRA response:\n{json.dumps(json_content, indent=2, ensure_ascii=False)}")
+        logger.info(f"✅ Successfully generated AICCRA response with {len(json_content.get('results', []))} results")
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"📄 AICCRA response:\n{orjson.dumps(json_content, option=orjson.OPT_INDENT_2).decode()}")
         logger.info(f"⏱️ AICCRA Response time: {elapsed_time:.2f} seconds")
 
         result = {
@@ -110,6 +115,7 @@ def process_document_aiccra(bucket_name, file_key, prompt, user_id: str = None):
 
         if interaction_id:
             result["interaction_id"] = interaction_id
+            result["interaction"] = interaction
         
         return result
 
@@ -1,146 +1,167 @@
 import time
-import json
+import orjson
+import asyncio
+import hashlib
+import logging
+import itertools
 from app.utils.logger.logger_util import get_logger
-from app.llm.vectorize import get_all_reference_data
-from app.utils.s3.s3_util import read_document_from_s3
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from app.utils.config.config_util import STAR_BUCKET_KEY_NAME, MAPPING_URL
+from app.llm.vectorize import get_reference_text
+from app.utils.s3.s3_util import read_document_from_s3, normalize_document
+from app.utils.tokens.token_util import estimate_tokens, fit_token_budget
+from concurrent.futures import ThreadPoolExecutor
+from app.utils.config.config_util import STAR_BUCKET_KEY_NAME, MAPPING_URL, MAX_DOCUMENT_CONTEXT_TOKENS
 from app.utils.prompt.bulk_upload_capdev_prompt import PROMPT_BULK_UPLOAD_CAPDEV
-from app.llm.vectorize import get_embedding, store_temp_embeddings, get_relevant_chunk
-from app.llm.mining import initialize_reference_data, split_text, invoke_model, is_valid_json
-from app.llm.map_fields import map_fields_with_opensearch, clear_mapping_cache, get_cache_stats
+from app.llm.vectorize import get_embeddings_batch, store_temp_embeddings, get_relevant_chunk
+from app.llm.mining import (initialize_reference_data,
+                            split_text,
+                            cached_invoke_model,
+                            acached_invoke_model,
+                            create_bedrock_session,
+                            parse_json_or_none
+                            )
+from app.llm.map_fields import map_fields_bulk, clear_mapping_cache, get_cache_stats
 
 logger = get_logger()
 mapping_service_url = MAPPING_URL
 
+MAX_ROWS_PER_BATCH = 10
+MAX_BATCH_INPUT_TOKENS = 6000
+OUTPUT_TOKENS_PER_ROW = 1600
+MODEL_CONTEXT_TOKENS = 200_000
 
-def process_excel_in_batches(chunks, batch_size=5):
+# Forced on every batch so Bedrock returns the results as parsed tool input
+# rather than free text that may need fences stripped and JSON repaired
+CAPDEV_RESULTS_TOOL = {
+    "name": "emit_results",
+    "description": "Return the Capacity Sharing for Development results extracted from the batch data, with the fields described in the instructions.",
+    "input_schema": {
+        "type": "object",
+        "properties": {
+            "results": {
+                "type": "array",
+                "items": {"type": "object"}
+            }
+        },
+        "required": ["results"]
+    }
+}
+
+
+class LazyJSON:
+    """Defer serialization until a log record is actually formatted."""
+
+    __slots__ = ("obj", "limit")
+
+    def __init__(self, obj, limit=None):
+        self.obj = obj
+        self.limit = limit
+
+    def __str__(self):
+        text = orjson.dumps(self.obj, option=orjson.OPT_INDENT_2).decode()
+        return text if self.limit is None else f"{text[:self.limit]}..."
+
+
+def batch_token_budget(static_prefix, max_rows=MAX_ROWS_PER_BATCH, max_batch_tokens=MAX_BATCH_INPUT_TOKENS):
     """
-    Split Excel chunks into batches of specified size
+    Input-token budget for the rows of one batch.
+
+    What is left of the context window after the shared prefix and a full
+    batch's output allowance, capped at max_batch_tokens.
     """
-    batches = []
-    for i in range(0, len(chunks), batch_size):
-        batch = chunks[i:i + batch_size]
-        batches.append(batch)
-    return batches
+    available = MODEL_CONTEXT_TOKENS - estimate_tokens(static_prefix) - OUTPUT_TOKENS_PER_ROW * max_rows
+    if available < max_batch_tokens:
+        logger.warning(f"⚠️ Reference context leaves ~{available} tokens per batch (target {max_batch_tokens})")
+    return max(min(available, max_batch_tokens), 1)
 
 
-def process_single_batch(batch_chunks, prompt, batch_number, all_reference_data, mapping_service_url=mapping_service_url):
+def unique_rows(chunks, stats):
     """
-    Process a single batch of chunks (thread-safe)
+    Yield each distinct row once, counting total and unique rows into stats.
+
+    Only a digest of each row is kept, so rows can be consumed lazily.
+    """
+    seen = set()
+    for chunk in chunks:
+        stats["total_rows"] += 1
+        digest = hashlib.blake2b(chunk.encode("utf-8"), digest_size=16).digest()
+        if digest in seen:
+            continue
+        seen.add(digest)
+        stats["unique_rows"] += 1
+        yield chunk
+
+
+def process_excel_in_batches(chunks, batch_size=None, max_rows=MAX_ROWS_PER_BATCH, max_batch_tokens=MAX_BATCH_INPUT_TOKENS):
+    """
+    Lazily split Excel chunks (any iterable) into batches.
+
+    With batch_size the chunks are split into fixed-size batches. Otherwise rows
+    are packed greedily until the batch reaches max_rows or its estimated input
+    tokens would exceed max_batch_tokens, so short rows share fewer LLM calls
+    and long rows don't overflow the context.
+    """
+    chunks = iter(chunks)
+
+    if batch_size:
+        while batch := list(itertools.islice(chunks, batch_size)):
+            yield batch
+        return
+
+    batch = []
+    batch_tokens = 0
+    for chunk in chunks:
+        chunk_tokens = estimate_tokens(chunk)
+        if batch and (len(batch) >= max_rows or batch_tokens + chunk_tokens > max_batch_tokens):
+            yield batch
+            batch = []
+            batch_tokens = 0
+        batch.append(chunk)
+        batch_tokens += chunk_tokens
+
+    if batch:
+        yield batch
+
+
+async def process_single_batch(session, batch_chunks, batch_number, static_prefix):
+    """
+    Stage 1: run the LLM over a single batch of chunks on the shared Bedrock session.
+
+    static_prefix holds the reference data and instructions, byte-identical for
+    every batch of a document so Bedrock can serve it from the prompt cache;
+    only the batch rows vary between calls. Field mapping is left to
+    map_batch_results so it can overlap with the next batch's LLM call.
     """
     logger.info(f"🔄 [Thread-{batch_number}] Processing batch {batch_number} with {len(batch_chunks)} rows...")
     
     try:
-        batch_data = "\n".join(batch_chunks)
-        
-        if isinstance(all_reference_data, list):
-            reference_text = "\n".join(all_reference_data)
-        elif isinstance(all_reference_data, str):
-            reference_text = all_reference_data
-        else:
-            logger.warning(f"⚠️ [Thread-{batch_number}] Unexpected reference_data type: {type(all_reference_data)}")
-            reference_text = str(all_reference_data)
-        
-        context = reference_text + f"\n\nBatch Data to Process:\n{batch_data}"
-
-        query = f"""
-        Based on this context:\n{context}\n\n
-        Do the following:\n{prompt}
-        """
+        query = "".join(("Batch Data to Process:\n", "\n".join(batch_chunks)))
 
-        response_text = invoke_model(query, max_tokens=8000)
+        response = await acached_invoke_model(
+            session,
+            query,
+            max_tokens=OUTPUT_TOKENS_PER_ROW * len(batch_chunks),
+            cached_prefix=static_prefix,
+            tool=CAPDEV_RESULTS_TOOL
+        )
         
         logger.info(f"✅ [Thread-{batch_number}] Batch {batch_number} processed successfully")
         
-        if is_valid_json(response_text):
-            parsed_result = json.loads(response_text)
-            
-            if isinstance(parsed_result, dict) and "results" in parsed_result:
-                for i, result in enumerate(parsed_result["results"]):
-                    if isinstance(result, dict):
-                        result_title = result.get("title", f"Result {i+1}")
-                        logger.info(f"🔍 [Thread-{batch_number}] Processing result {i+1}: '{result_title}'")
-                        
-                        result["batch_number"] = batch_number
+        if isinstance(response, dict):
+            parsed_result = response
+        else:
+            parsed_result = parse_json_or_none(response)
+            if parsed_result is None:
+                logger.warning(f"⚠️ [Thread-{batch_number}] Batch {batch_number} response is not valid JSON")
+                return {"results": [{"text": response, "batch": batch_number, "parsing_error": True}]}
 
-                        partners = result.get("partners", [])
-                        logger.info(f"👥 [Thread-{batch_number}] Result '{result_title}' has {len(partners)} partners: {[p.get('institution_name', 'Unknown') for p in partners if isinstance(p, dict)]}")
-
-                        if mapping_service_url:
-                            try:
-                                logger.info(f"🔗 [Thread-{batch_number}] Starting field mapping for '{result_title}'...")
-                                result_before_mapping = json.dumps(result, indent=2)
-                                
-                                result = map_fields_with_opensearch(result, mapping_service_url)
-                                
-                                result_after_mapping = json.dumps(result, indent=2)
-                                
-                                partners_after = result.get("partners", [])
-                                mapped_partners = [p for p in partners_after if isinstance(p, dict) and p.get("institution_id")]
-                                
-                                logger.info(f"✅ [Thread-{batch_number}] Field mapping completed for '{result_title}'. Mapped {len(mapped_partners)}/{len(partners_after)} partners")
-                                
-                                for j, partner in enumerate(partners_after):
-                                    if isinstance(partner, dict):
-                                        partner_name = partner.get("institution_name", "Unknown")
-                                        institution_id = partner.get("institution_id")
-                                        score = partner.get("similarity_score")
-                                        
-                                        if institution_id:
-                                            logger.info(f"  ✅ Partner {j+1}: '{partner_name}' → ID: {institution_id}, Score: {score}")
-                                        else:
-                                            logger.warning(f"  ❌ Partner {j+1}: '{partner_name}' → NOT MAPPED")
-                                
-                                if len(partners) > 0 and len(mapped_partners) == 0:
-                                    logger.error(f"🚨 [Thread-{batch_number}] CRITICAL: No partners were mapped for '{result_title}' despite having {len(partners)} partners!")
-                                    logger.error(f"🚨 Before mapping: {result_before_mapping[:500]}...")
-                                    logger.error(f"🚨 After mapping: {result_after_mapping[:500]}...")
-                                    
-                            except Exception as map_error:
-                                logger.error(f"❌ [Thread-{batch_number}] Field mapping FAILED for '{result_title}': {str(map_error)}")
-                                logger.error(f"❌ Error type: {type(map_error).__name__}")
-                                logger.error(f"❌ Result data: {json.dumps(result, indent=2)[:500]}...")
-                        else:
-                            logger.warning(f"⚠️ [Thread-{batch_number}] Field mapping DISABLED (no mapping_service_url provided)")
-                    else:
-                        logger.warning(f"⚠️ [Thread-{batch_number}] Result {i+1} is not a dict: {type(result)}")
-            else:
-                logger.warning(f"⚠️ [Thread-{batch_number}] Parsed result doesn't have 'results' key or is not a dict")
-            
-            return parsed_result
-        
+        if isinstance(parsed_result, dict) and "results" in parsed_result:
+            for result in parsed_result["results"]:
+                if isinstance(result, dict):
+                    result["batch_number"] = batch_number
         else:
-            logger.warning(f"⚠️ [Thread-{batch_number}] Batch {batch_number} response is not valid JSON")
-            cleaned_response = response_text.strip()
-            if cleaned_response.startswith('```json'):
-                cleaned_response = cleaned_response.replace('```json', '').replace('```', '').strip()
-            
-            if is_valid_json(cleaned_response):
-                parsed_result = json.loads(cleaned_response)
-                if isinstance(parsed_result, dict) and "results" in parsed_result:
-                    logger.info(f"📊 [Thread-{batch_number}] Found {len(parsed_result['results'])} results in cleaned batch {batch_number}")
-                    
-                    for i, result in enumerate(parsed_result["results"]):
-                        if isinstance(result, dict):
-                            result_title = result.get("title", f"Cleaned Result {i+1}")
-                            logger.info(f"🔍 [Thread-{batch_number}] Processing cleaned result {i+1}: '{result_title}'")
-                            
-                            result["batch_number"] = batch_number
-
-                            if mapping_service_url:
-                                try:
-                                    logger.info(f"🔗 [Thread-{batch_number}] Starting field mapping for cleaned '{result_title}'...")
-                                    result = map_fields_with_opensearch(result, mapping_service_url)
-                                    logger.info(f"✅ [Thread-{batch_number}] Field mapping completed for cleaned '{result_title}'")
-                                except Exception as map_error:
-                                    logger.error(f"❌ [Thread-{batch_number}] Field mapping FAILED for cleaned '{result_title}': {str(map_error)}")
-                            else:
-                                logger.warning(f"⚠️ Field mapping disabled (no mapping_service_url provided)")
-
-                return parsed_result
-            
-            return {"results": [{"text": response_text, "batch": batch_number, "parsing_error": True}]}
+            logger.warning(f"⚠️ [Thread-{batch_number}] Parsed result doesn't have 'results' key or is not a dict")
+
+        return parsed_result
             
     except Exception as e:
         logger.error(f"❌ [Thread-{batch_number}] Error processing batch {batch_number}: {str(e)}")
@@ -148,17 +169,103 @@ def process_single_batch(batch_chunks, prompt, batch_number, all_reference_data,
         return {"results": [{"error": str(e), "batch": batch_number}]}
 
 
-def merge_batch_results(batch_results_with_numbers):
+def map_batch_results(parsed_result, batch_number, mapping_service_url=mapping_service_url):
     """
-    Combine all batch results into a single JSON, maintaining the original order.
+    Stage 2: map the partners and people of a parsed batch (thread-safe).
+
+    All results of the batch are sent to the mapping service in one request.
     """
-    sorted_results = sorted(batch_results_with_numbers, key=lambda x: x[1])
-    
-    merged_results = {"results": []}
-    total_mapped_partners = 0
-    total_partners = 0
-    
-    for batch_result, batch_number in sorted_results:
+    if not (isinstance(parsed_result, dict) and isinstance(parsed_result.get("results"), list)):
+        return parsed_result
+
+    if not mapping_service_url:
+        logger.warning(f"⚠️ [Thread-{batch_number}] Field mapping DISABLED (no mapping_service_url provided)")
+        return parsed_result
+
+    results = []
+    for i, result in enumerate(parsed_result["results"]):
+        if not isinstance(result, dict):
+            logger.warning(f"⚠️ [Thread-{batch_number}] Result {i+1} is not a dict: {type(result)}")
+        elif "error" not in result and not result.get("parsing_error"):
+            results.append(result)
+
+    if not results:
+        return parsed_result
+
+    try:
+        logger.info(f"🔗 [Thread-{batch_number}] Starting field mapping for {len(results)} results...")
+        # Snapshots are only worth their serialization cost when someone reads them
+        results_before_mapping = (
+            [orjson.dumps(result, option=orjson.OPT_INDENT_2).decode() for result in results]
+            if logger.isEnabledFor(logging.DEBUG) else None
+        )
+
+        map_fields_bulk(results, mapping_service_url)
+    except Exception as map_error:
+        logger.error(f"❌ [Thread-{batch_number}] Field mapping FAILED for batch {batch_number}: {str(map_error)}")
+        logger.error(f"❌ Error type: {type(map_error).__name__}")
+        return parsed_result
+
+    log_partners = logger.isEnabledFor(logging.INFO)
+
+    for i, result in enumerate(results):
+        result_title = result.get("title", f"Result {i+1}")
+        partners = result.get("partners", [])
+
+        # One pass over the partners: count the mapped ones and build the log lines
+        mapped_count = 0
+        partner_lines = []
+        unmapped_names = []
+        for j, partner in enumerate(partners):
+            if not isinstance(partner, dict):
+                continue
+            partner_name = partner.get("institution_name", "Unknown")
+            if institution_id := partner.get("institution_id"):
+                mapped_count += 1
+                if log_partners:
+                    partner_lines.append(f"  ✅ Partner {j+1}: '{partner_name}' → ID: {institution_id}, Score: {partner.get('similarity_score')}")
+            else:
+                unmapped_names.append(f"{j+1}: '{partner_name}'")
+
+        if log_partners:
+            summary = f"✅ [Thread-{batch_number}] Field mapping completed for '{result_title}'. Mapped {mapped_count}/{len(partners)} partners"
+            logger.info("\n".join([summary, *partner_lines]))
+        
+        if unmapped_names:
+            logger.warning(f"  ❌ [Thread-{batch_number}] Partners NOT MAPPED for '{result_title}': {', '.join(unmapped_names)}")
+        
+        if len(partners) > 0 and mapped_count == 0:
+            logger.error(f"🚨 [Thread-{batch_number}] CRITICAL: No partners were mapped for '{result_title}' despite having {len(partners)} partners!")
+            if results_before_mapping:
+                logger.debug("🚨 Before mapping: %s...", results_before_mapping[i][:500])
+            logger.error("🚨 After mapping: %s", LazyJSON(result, limit=500))
+
+    return parsed_result
+
+
+class BatchResultMerger:
+    """
+    Merge batch results into a single JSON as they complete.
+
+    Batches finish out of order; each one is held only until every earlier
+    batch has arrived, then folded into the merged results, so the original
+    row order is kept without collecting and sorting everything at the end.
+    """
+
+    def __init__(self):
+        self.merged_results = {"results": []}
+        self.batches_merged = 0
+        self.total_partners = 0
+        self.total_mapped_partners = 0
+        self._pending = {}
+
+    def add(self, batch_number, batch_result):
+        self._pending[batch_number] = batch_result
+        while (next_batch := self.batches_merged + 1) in self._pending:
+            self._merge(next_batch, self._pending.pop(next_batch))
+            self.batches_merged = next_batch
+
+    def _merge(self, batch_number, batch_result):
         if isinstance(batch_result, dict):
             if "results" in batch_result and isinstance(batch_result["results"], list):
                 logger.info(f"📦 Merging batch {batch_number} with {len(batch_result['results'])} results")
@@ -166,157 +273,202 @@ def merge_batch_results(batch_results_with_numbers):
                 for result in batch_result["results"]:
                     if isinstance(result, dict):
                         partners = result.get("partners", [])
-                        total_partners += len(partners)
-                        mapped_partners = [p for p in partners if isinstance(p, dict) and p.get("institution_id")]
-                        total_mapped_partners += len(mapped_partners)
+                        self.total_partners += len(partners)
+                        self.total_mapped_partners += sum(1 for p in partners if isinstance(p, dict) and p.get("institution_id"))
                 
-                merged_results["results"].extend(batch_result["results"])
+                self.merged_results["results"].extend(batch_result["results"])
             else:
-                merged_results["results"].append(batch_result)
+                self.merged_results["results"].append(batch_result)
         else:
-            merged_results["results"].append({"data": batch_result, "batch": batch_number})
-    
-    logger.info(f"📊 Merged {len(merged_results['results'])} total results from all batches")
-    logger.info(f"🔗 Mapping summary: {total_mapped_partners}/{total_partners} partners successfully mapped")
-    
-    return merged_results
+            self.merged_results["results"].append({"data": batch_result, "batch": batch_number})
+
+    def finish(self):
+        logger.info(f"📊 Merged {len(self.merged_results['results'])} total results from all batches")
+        logger.info(f"🔗 Mapping summary: {self.total_mapped_partners}/{self.total_partners} partners successfully mapped")
+        return self.merged_results
 
 
-def process_batches_in_groups(batches, prompt, all_reference_data, group_size=20, max_workers=20):
+def merge_batch_results(batch_results):
     """
-    Process batches in sequential groups to avoid overwhelming services
+    Combine all batch results, given in batch order, into a single JSON.
     """
-    all_results = []
-    total_groups = (len(batches) + group_size - 1) // group_size
-    
-    logger.info(f"📦 Processing {len(batches)} batches in {total_groups} sequential groups of {group_size} batches each")
-    logger.info(f"🔧 Using {max_workers} workers per group")
-    
-    for group_idx in range(0, len(batches), group_size):
-        group_batches = batches[group_idx:group_idx + group_size]
-        group_number = (group_idx // group_size) + 1
-        
-        logger.info(f"🔄 Processing group {group_number}/{total_groups} with {len(group_batches)} batches...")
-        
-        group_results = []
-        with ThreadPoolExecutor(max_workers=max_workers) as executor:
-            future_to_batch = {}
-            
-            for batch_idx, batch in enumerate(group_batches):
-                batch_number = group_idx + batch_idx + 1
-                future = executor.submit(
-                    process_single_batch,
-                    batch, prompt, batch_number, all_reference_data
-                )
-                future_to_batch[future] = batch_number
-            
-            for future in as_completed(future_to_batch):
-                batch_number = future_to_batch[future]
-                try:
-                    batch_result = future.result()
-                    group_results.append((batch_result, batch_number))
-                    logger.info(f"✅ Completed batch {batch_number} in group {group_number}")
-                except Exception as e:
-                    logger.error(f"❌ Exception in batch {batch_number}: {str(e)}")
-                    error_result = {"results": [{"error": str(e), "batch": batch_number}]}
-                    group_results.append((error_result, batch_number))
-        
-        all_results.extend(group_results)
-        
-        logger.info(f"✅ Completed group {group_number}/{total_groups}")
-        
-        if group_number < total_groups:
-            logger.info("⏳ Waiting 2 seconds before next group...")
-            time.sleep(2)
-    
-    return all_results
+    merger = BatchResultMerger()
+    for batch_number, batch_result in enumerate(batch_results, start=1):
+        merger.add(batch_number, batch_result)
+    return merger.finish()
+
+
+async def process_batches_async(batches, static_prefix, max_workers=20):
+    """
+    Process all batches concurrently, with at most max_workers batches in flight.
+
+    batches may be a lazy iterator: the next batch is only drawn once a slot is
+    free, so rows are read and packed no faster than they are sent. Batches are
+    admitted as soon as a slot frees up instead of waiting for a
+    whole group to finish. Each batch is a two-stage pipeline: the LLM call is a
+    coroutine on one shared aiohttp session and holds a slot, then the blocking
+    field mapping runs on map_pool after the slot is released, so one batch's
+    mapping lookups overlap with the next batch's Bedrock call.
 
+    Finished batches are streamed into a BatchResultMerger, which is returned.
+    """
+    loop = asyncio.get_running_loop()
+    semaphore = asyncio.Semaphore(max_workers)
+    merger = BatchResultMerger()
+
+    logger.info(f"📦 Processing batches with up to {max_workers} in flight")
+
+    async def run_batch(batch, batch_number):
+        try:
+            try:
+                batch_result = await process_single_batch(session, batch, batch_number, static_prefix)
+            finally:
+                semaphore.release()
+            batch_result = await loop.run_in_executor(
+                map_pool, map_batch_results,
+                batch_result, batch_number
+            )
+            logger.info(f"✅ Completed batch {batch_number}")
+        except Exception as e:
+            logger.error(f"❌ Exception in batch {batch_number}: {str(e)}")
+            batch_result = {"results": [{"error": str(e), "batch": batch_number}]}
+        merger.add(batch_number, batch_result)
+
+    async with create_bedrock_session(max_workers) as session:
+        with ThreadPoolExecutor(max_workers=max_workers) as map_pool:
+            tasks = []
+            batch_iter = iter(batches)
+            try:
+                for batch_number in itertools.count(1):
+                    await semaphore.acquire()
+                    # Reading and packing rows is blocking work, kept off the event loop
+                    batch = await asyncio.to_thread(next, batch_iter, None)
+                    if batch is None:
+                        semaphore.release()
+                        break
+                    tasks.append(asyncio.create_task(run_batch(batch, batch_number)))
+            except BaseException:
+                # e.g. a malformed row: stop the batches already in flight before the
+                # session and map_pool are closed under them
+                for task in tasks:
+                    task.cancel()
+                raise
+            finally:
+                await asyncio.gather(*tasks, return_exceptions=True)
+
+    return merger
+
+
+def _prepare_document(bucket_name, file_key):
+    """Load the reference data and read the document (blocking; run in a worker thread)"""
+    reference_file_regions = f"{STAR_BUCKET_KEY_NAME}/clarisa_regions.xlsx"
+    reference_file_countries = f"{STAR_BUCKET_KEY_NAME}/clarisa_countries.xlsx"
+    initialize_reference_data(
+        bucket_name, reference_file_regions, reference_file_countries)
+
+    doc = normalize_document(read_document_from_s3(bucket_name, file_key, stream_rows=True))
+    return doc, split_text(doc), get_reference_text()
+
+
+def _invoke_on_text_document(chunks, file_key, prompt, reference_text):
+    """Embed a non-Excel document and ask the model about its most relevant chunks (blocking)"""
+    logger.info("#️⃣ Generating embeddings...")
+
+    embeddings = get_embeddings_batch(chunks)
+    db, temp_table_name, document_name = store_temp_embeddings(chunks, embeddings, file_key)
+    relevant_chunks = fit_token_budget(
+        get_relevant_chunk(prompt, db, temp_table_name, document_name), MAX_DOCUMENT_CONTEXT_TOKENS)
+
+    query = "".join(("\n".join(relevant_chunks), "\n\nDo the following:\n", prompt))
 
-def process_document_capdev(bucket_name, file_key, prompt=PROMPT_BULK_UPLOAD_CAPDEV, max_workers=20, group_size=20):
+    return cached_invoke_model(
+        query,
+        max_tokens=4000,
+        cached_prefix="".join(("Based on this context:\n", reference_text, "\n"))
+    )
+
+
+async def process_document_capdev(bucket_name, file_key, prompt=PROMPT_BULK_UPLOAD_CAPDEV, max_workers=20):
+    """
+    Runs on the MCP server's event loop, which other tool calls share: only the
+    batch fan-out stays on the loop, the blocking steps run in worker threads.
+    """
     start_time = time.time()
 
     try:
         # Clear mapping cache at the start of each document processing
         clear_mapping_cache()
         logger.info(f"🚀 Starting document processing: {file_key}")
-        
-        reference_file_regions = f"{STAR_BUCKET_KEY_NAME}/clarisa_regions.xlsx"
-        reference_file_countries = f"{STAR_BUCKET_KEY_NAME}/clarisa_countries.xlsx"
-        initialize_reference_data(
-            bucket_name, reference_file_regions, reference_file_countries)
 
-        document_content = read_document_from_s3(bucket_name, file_key)
-        chunks = split_text(document_content)
+        doc, chunks, reference_text = await asyncio.to_thread(_prepare_document, bucket_name, file_key)
 
-        all_reference_data = get_all_reference_data()
+        if doc.kind == "excel":
+            logger.info("📊 Excel file detected. Streaming rows into concurrent batches...")
 
-        if isinstance(document_content, dict) and document_content.get("type") == "excel":
-            logger.info(f"📊 Excel file detected with {len(chunks)} rows. Processing in sequential groups...")
+            row_stats = {"total_rows": 0, "unique_rows": 0}
+            static_prefix = "".join((
+                "Based on this context:\n", reference_text,
+                "\n\nDo the following for the batch data below:\n", prompt
+            ))
 
-            batches = process_excel_in_batches(chunks, batch_size=5)
-            logger.info(f"📦 Created {len(batches)} batches")
-            logger.info(f"🔧 Will process in groups of {group_size} batches with {max_workers} workers per group")
-            logger.info(f"📋 Each group processes {group_size * 5} rows ({group_size} batches x 5 rows per batch)")
-            
-            batch_results_with_numbers = process_batches_in_groups(
-                batches, prompt, all_reference_data, group_size, max_workers
+            max_batch_tokens = batch_token_budget(static_prefix)
+            batches = process_excel_in_batches(unique_rows(chunks, row_stats), max_batch_tokens=max_batch_tokens)
+            logger.info(f"📦 Packing batches of up to {MAX_ROWS_PER_BATCH} rows / ~{max_batch_tokens} tokens each")
+
+            merger = await process_batches_async(
+                batches, static_prefix, max_workers
             )
             
-            final_result = merge_batch_results(batch_results_with_numbers)
+            final_result = merger.finish()
+            batches_processed = merger.batches_merged
+
+            duplicate_rows = row_stats["total_rows"] - row_stats["unique_rows"]
+            if duplicate_rows:
+                logger.info(f"♻️ Skipped {duplicate_rows} duplicate rows")
             
             end_time = time.time()
             elapsed_time = end_time - start_time
 
             cache_stats = get_cache_stats()
             
-            logger.info(f"✅ Successfully processed all {len(batches)} batches in sequential groups")
+            logger.info(f"✅ Successfully processed all {batches_processed} batches")
             logger.info(f"📊 Total results: {len(final_result.get('results', []))}")
             logger.info(f"⏱️ Total processing time: {elapsed_time:.2f} seconds")
-            logger.info(f"🚀 Used {max_workers} workers per group, {group_size} batches per group")
+            logger.info(f"🚀 Used up to {max_workers} concurrent batches")
             logger.info(f"💾 Cache performance: {cache_stats['total_entries']} unique entities cached")
 
-            logger.info(f"✅ Successfully generated response:\n{json.dumps(final_result, indent=2, ensure_ascii=False)}")
+            # Serialized once and compact: the MCP tool returns this string to a service, not a person
+            json_content = orjson.dumps(final_result).decode()
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(f"✅ Successfully generated response:\n{json_content}")
             
             return {
                 "content": final_result,
                 "time_taken": f"{elapsed_time:.2f}",
-                "json_content": json.dumps(final_result, ensure_ascii=False, indent=2),
-                "batches_processed": len(batches),
-                "total_rows": len(chunks),
-                "workers_used": max_workers,
-                "group_size": group_size,
-                "total_groups": (len(batches) + group_size - 1) // group_size
+                "json_content": json_content,
+                "batches_processed": batches_processed,
+                "total_rows": row_stats["total_rows"],
+                "unique_rows": row_stats["unique_rows"],
+                "workers_used": max_workers
             }
             
         else:
             logger.info(f"📄 Non-Excel file detected. Using standard processing...")
-            logger.info("#️⃣ Generating embeddings...")
-            
-            embeddings = [get_embedding(chunk) for chunk in chunks]
-            db, temp_table_name, document_name = store_temp_embeddings(chunks, embeddings, file_key)
-            relevant_chunks = get_relevant_chunk(prompt, db, temp_table_name, document_name)
-            
-            if isinstance(all_reference_data, list):
-                context = "\n".join(all_reference_data) + relevant_chunks
-            else:
-                context = str(all_reference_data) + relevant_chunks
-
-            query = f"""
-            Based on this context:\n{context}\n\n
-            Do the following:\n{prompt}
-            """
 
-            response_text = invoke_model(query, max_tokens=4000)
+            response_text = await asyncio.to_thread(
+                _invoke_on_text_document, chunks, file_key, prompt, reference_text)
 
             end_time = time.time()
             elapsed_time = end_time - start_time
             logger.info(f"✅ Successfully generated response:\n{response_text}")
             logger.info(f"⏱️ Response time: {elapsed_time:.2f} seconds")
 
+            json_content = parse_json_or_none(response_text)
+
             return {
                 "content": response_text,
                 "time_taken": f"{elapsed_time:.2f}",
-                "json_content": json.loads(response_text) if is_valid_json(response_text) else {"text": response_text}
+                "json_content": json_content if json_content is not None else {"text": response_text}
             }
 
     except Exception as e:
@@ -1,14 +1,68 @@
 import time
 import requests
 import threading
+from urllib3.util.retry import Retry
+from requests.adapters import HTTPAdapter
 from app.utils.logger.logger_util import get_logger
 
 logger = get_logger()
 
+# Shared keep-alive session; retries stay in _request_mapping, which logs and backs off
+_session = requests.Session()
+_adapter = HTTPAdapter(pool_connections=32, pool_maxsize=32, max_retries=Retry(total=0))
+_session.mount("http://", _adapter)
+_session.mount("https://", _adapter)
+
 # Global cache for mapped fields (thread-safe)
 _mapping_cache = {}
 _cache_lock = threading.Lock()
 
+MAX_CONCURRENT_MAPPING_REQUESTS = 8
+MAX_RETRY_WAIT_SECONDS = 30
+BREAKER_FAILURE_THRESHOLD = 5
+BREAKER_COOLDOWN_SECONDS = 60
+
+# Caps in-flight mapping requests across the batch worker threads
+_request_slots = threading.BoundedSemaphore(MAX_CONCURRENT_MAPPING_REQUESTS)
+
+
+class _Breaker:
+    """
+    Circuit breaker shared by every mapping call. After BREAKER_FAILURE_THRESHOLD
+    consecutive 5xx responses, calls fail fast for BREAKER_COOLDOWN_SECONDS
+    instead of each thread sleeping through its own backoff schedule.
+    """
+    state = "closed"
+    failures = 0
+    opened_at = 0.0
+    lock = threading.Lock()
+
+    @classmethod
+    def is_open(cls):
+        with cls.lock:
+            if cls.state == "open" and time.monotonic() - cls.opened_at < BREAKER_COOLDOWN_SECONDS:
+                return True
+            # Cooldown elapsed: let calls through again, one more failure re-opens it
+            if cls.state == "open":
+                cls.state = "half-open"
+            return False
+
+    @classmethod
+    def record_success(cls):
+        with cls.lock:
+            cls.state = "closed"
+            cls.failures = 0
+
+    @classmethod
+    def record_failure(cls):
+        with cls.lock:
+            cls.failures += 1
+            if cls.state == "half-open" or cls.failures >= BREAKER_FAILURE_THRESHOLD:
+                if cls.state != "open":
+                    logger.error(f"🚫 Mapping service circuit opened after {cls.failures} consecutive failures, skipping calls for {BREAKER_COOLDOWN_SECONDS}s")
+                cls.state = "open"
+                cls.opened_at = time.monotonic()
+
 def clear_mapping_cache():
     """Clear the mapping cache (useful between different file processing)"""
     global _mapping_cache
@@ -24,30 +78,35 @@ def get_cache_stats():
             "entries": list(_mapping_cache.keys())
         }
 
-def map_fields_with_opensearch(mining_result, mapping_service_url, max_retries=10, retry_delay=4):
-    entries = []
+def _collect_entries(mining_result):
+    """Entries to map for one result, each (value, type) pair only once"""
+    entries = {}
+
+    def add(value, entry_type):
+        entries.setdefault((value, entry_type), {"value": value, "type": entry_type})
 
     if contact := mining_result.get("main_contact_person", {}).get("name"):
-        entries.append({"value": contact, "type": "staff"})
+        add(contact, "staff")
 
     if supervisor := mining_result.get("training_supervisor", {}).get("name"):
-        entries.append({"value": supervisor, "type": "staff"})
+        add(supervisor, "staff")
 
     if affiliation := mining_result.get("trainee_affiliation", {}).get("institution_name"):
-        entries.append({"value": affiliation, "type": "institution"})
+        add(affiliation, "institution")
 
     for partner in mining_result.get("partners", []):
         if partner_name := partner.get("institution_name"):
-            entries.append({"value": partner_name, "type": "institution"})
+            add(partner_name, "institution")
 
     for trainee in mining_result.get("trainees_description", []):
         if trainee_name := trainee.get("institution_name"):
-            entries.append({"value": trainee_name, "type": "institution"})
+            add(trainee_name, "institution")
 
-    if not entries:
-        return mining_result
+    return list(entries.values())
 
-    # Check cache and filter out already mapped entries
+
+def _split_cached(entries):
+    """Return (cached_results, entries_to_map) for the given entries."""
     entries_to_map = []
     cached_results = {}
     
@@ -59,50 +118,37 @@ def map_fields_with_opensearch(mining_result, mapping_service_url, max_retries=1
             else:
                 entries_to_map.append(entry)
     
-    if cached_results:
-        logger.info(f"💾 Found {len(cached_results)} entries in cache, need to map {len(entries_to_map)} new entries")
-    
-    # If all entries are cached, apply and return immediately
-    if not entries_to_map:
-        logger.info(f"✨ All {len(entries)} entries found in cache! No API call needed.")
-        _apply_mapped_results(mining_result, cached_results)
-        return mining_result
-    
-    # Only map entries not in cache
-    mapped_dict = cached_results.copy()
+    return cached_results, entries_to_map
 
+
+def _request_mapping(entries_to_map, mapping_service_url, max_retries, retry_delay):
+    """POST entries to the mapping service with retries. Returns the mapped list, or None on failure."""
     for attempt in range(max_retries):
+        if _Breaker.is_open():
+            logger.warning(f"🚫 Mapping service circuit is open, skipping {len(entries_to_map)} entries")
+            return None
+
         try:
             logger.info(f"🔗 Attempting mapping (attempt {attempt + 1}/{max_retries}) for {len(entries_to_map)} new entries")
 
-            response = requests.post(
-                f"{mapping_service_url}/map/fields",
-                json={"entries": entries_to_map},
-                timeout=600
-            )
+            with _request_slots:
+                response = _session.post(
+                    f"{mapping_service_url}/map/fields",
+                    json={"entries": entries_to_map},
+                    timeout=600
+                )
             response.raise_for_status()
 
             mapped = response.json().get("results", [])
+            _Breaker.record_success()
             logger.info(f"✅ Mapping successful on attempt {attempt + 1}")
-
-            # Add newly mapped results to mapped_dict and cache
-            with _cache_lock:
-                for m in mapped:
-                    key = (m["original_value"], m["type"])
-                    mapped_dict[key] = m
-                    _mapping_cache[key] = m
-                    logger.info(f"💾 Cached: {m['type']} '{m['original_value']}' → {m.get('mapped_id')}")
-            
-            _apply_mapped_results(mining_result, mapped_dict)
-            
-            logger.info(f"📊 Cache stats: {len(_mapping_cache)} total cached entries")
-            
-            return mining_result
+            return mapped
         
         except requests.exceptions.HTTPError as e:
             if e.response.status_code in [500, 502, 503, 504]:
+                _Breaker.record_failure()
                 if attempt < max_retries - 1:
-                    wait_time = retry_delay * (2 ** attempt)
+                    wait_time = min(retry_delay * (2 ** attempt), MAX_RETRY_WAIT_SECONDS)
                     logger.warning(f"⚠️ Service unavailable (503), retrying in {wait_time}s (attempt {attempt + 1}/{max_retries})")
                     time.sleep(wait_time)
                     continue
@@ -114,17 +160,100 @@ def map_fields_with_opensearch(mining_result, mapping_service_url, max_retries=1
                 
         except Exception as e:
             logger.error(f"❌ Error on attempt {attempt + 1}: {e}")
+            _Breaker.record_failure()
             if attempt < max_retries - 1:
                 time.sleep(retry_delay)
             else:
                 break
 
+    return None
+
+
+def _cache_mapped(mapped, mapped_dict):
+    with _cache_lock:
+        for m in mapped:
+            key = (m["original_value"], m["type"])
+            mapped_dict[key] = m
+            _mapping_cache[key] = m
+            logger.info(f"💾 Cached: {m['type']} '{m['original_value']}' → {m.get('mapped_id')}")
+
+
+def map_fields_with_opensearch(mining_result, mapping_service_url, max_retries=10, retry_delay=4):
+    entries = _collect_entries(mining_result)
+
+    if not entries:
+        return mining_result
+
+    # Check cache and filter out already mapped entries
+    cached_results, entries_to_map = _split_cached(entries)
+    
+    if cached_results:
+        logger.info(f"💾 Found {len(cached_results)} entries in cache, need to map {len(entries_to_map)} new entries")
+    
+    # If all entries are cached, apply and return immediately
+    if not entries_to_map:
+        logger.info(f"✨ All {len(entries)} entries found in cache! No API call needed.")
+        _apply_mapped_results(mining_result, cached_results)
+        return mining_result
+    
+    # Only map entries not in cache
+    mapped_dict = cached_results.copy()
+
+    mapped = _request_mapping(entries_to_map, mapping_service_url, max_retries, retry_delay)
+    if mapped is not None:
+        _cache_mapped(mapped, mapped_dict)
+        _apply_mapped_results(mining_result, mapped_dict)
+        logger.info(f"📊 Cache stats: {len(_mapping_cache)} total cached entries")
+        return mining_result
+
     logger.warning(f"⚠️ Mapping failed after {max_retries} attempts, applying default values")
     _apply_default_values(mining_result)
     
     return mining_result
 
 
+def map_fields_bulk(mining_results, mapping_service_url, max_retries=10, retry_delay=4):
+    """
+    Map the fields of several results with a single mapping service call.
+
+    Entries are collected and de-duplicated across all results, so a name that
+    appears in many results of a batch is only sent (and cached) once.
+    """
+    results = [r for r in mining_results if isinstance(r, dict)]
+
+    unique_entries = {}
+    for result in results:
+        for entry in _collect_entries(result):
+            unique_entries.setdefault((entry["value"], entry["type"]), entry)
+
+    if not unique_entries:
+        return mining_results
+
+    cached_results, entries_to_map = _split_cached(unique_entries.values())
+    mapped_dict = cached_results.copy()
+
+    if entries_to_map:
+        logger.info(f"💾 Found {len(cached_results)} entries in cache, need to map {len(entries_to_map)} new entries for {len(results)} results")
+        mapped = _request_mapping(entries_to_map, mapping_service_url, max_retries, retry_delay)
+
+        if mapped is None:
+            logger.warning(f"⚠️ Mapping failed after {max_retries} attempts, applying default values")
+            for result in results:
+                _apply_mapped_results(result, mapped_dict)
+                _apply_default_values(result)
+            return mining_results
+
+        _cache_mapped(mapped, mapped_dict)
+        logger.info(f"📊 Cache stats: {len(_mapping_cache)} total cached entries")
+    else:
+        logger.info(f"✨ All {len(unique_entries)} entries found in cache! No API call needed.")
+
+    for result in results:
+        _apply_mapped_results(result, mapped_dict)
+
+    return mining_results
+
+
 def _apply_mapped_results(mining_result, mapped_dict):
     if contact := mining_result.get("main_contact_person", {}).get("name"):
         key = (contact, "staff")
@@ -1,90 +1,464 @@
-import time
+import ssl
+import copy
 import json
+import time
+import uuid
 import boto3
+import orjson
+import msgspec
+import certifi
+import asyncio
+import aiohttp
+import hashlib
+import logging
+import threading
+from yarl import URL
 from typing import Dict, Any
+from urllib.parse import quote
+from botocore.auth import SigV4Auth
+from botocore.config import Config
+from botocore.exceptions import ClientError
+from botocore.awsrequest import AWSRequest
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
+from collections import OrderedDict
 from app.utils.logger.logger_util import get_logger
-from app.utils.s3.s3_util import read_document_from_s3
-from app.llm.map_fields import map_fields_with_opensearch
+from app.utils.s3.s3_util import read_document_from_s3, normalize_document
+from app.utils.tokens.token_util import fit_token_budget
+from app.llm.map_fields import map_fields_with_opensearch, map_fields_bulk
 from app.utils.prompt.prompt_star import DEFAULT_PROMPT_STAR
 from app.utils.prompt.prompt_prms import DEFAULT_PROMPT_PRMS
-from langchain_text_splitters import RecursiveCharacterTextSplitter
-from app.utils.interactions.interaction_client import interaction_client
-from app.utils.config.config_util import AWS, STAR_BUCKET_KEY_NAME, PRMS_BUCKET_KEY_NAME, MAPPING_URL
-from app.schemas.mining_schemas import MiningResponse, ErrorResponse, InnovationDevelopmentResult, PolicyChangeResult, CapacityDevelopmentResult
-from app.llm.vectorize import (get_embedding,
+from app.utils.config.config_util import (AWS, STAR_BUCKET_KEY_NAME, PRMS_BUCKET_KEY_NAME, MAPPING_URL,
+                                          BEDROCK_MODEL_ID, BEDROCK_LATENCY_MODE, MAX_DOCUMENT_CONTEXT_TOKENS,
+                                          TEXT_CHUNK_SIZE, TEXT_CHUNK_OVERLAP, BEDROCK_REGION, BEDROCK_ENDPOINT_URL)
+from pydantic import ValidationError
+from app.schemas.mining_schemas import ErrorResponse, ResultListAdapter
+from app.llm.vectorize import (get_embeddings_batch,
                                check_reference_exists,
                                store_reference_embeddings,
                                store_temp_embeddings,
-                               get_all_reference_data,
+                               get_reference_text,
                                get_relevant_chunk
                                )
 
 
 logger = get_logger()
 
+MODEL_ID = BEDROCK_MODEL_ID
+BEDROCK_BASE_URL = (BEDROCK_ENDPOINT_URL or f"https://bedrock-runtime.{BEDROCK_REGION}.amazonaws.com").rstrip("/")
+BEDROCK_INVOKE_URL = f"{BEDROCK_BASE_URL}/model/{quote(MODEL_ID, safe='')}/invoke"
+BEDROCK_MAX_ATTEMPTS = 4
+BEDROCK_RETRY_STATUSES = (429, 500, 502, 503, 504)
+BEDROCK_STANDARD_HEADERS = {"Content-Type": "application/json", "Accept": "application/json"}
+BEDROCK_REQUEST_HEADERS = BEDROCK_STANDARD_HEADERS
+if BEDROCK_LATENCY_MODE == "optimized":
+    BEDROCK_REQUEST_HEADERS = {**BEDROCK_STANDARD_HEADERS, "X-Amzn-Bedrock-PerformanceConfig-Latency": "optimized"}
+
+RESPONSE_CACHE_TTL_SECONDS = 24 * 60 * 60
+RESPONSE_CACHE_MAX_ENTRIES = 4096
+_response_cache = OrderedDict()
+_response_cache_lock = threading.Lock()
+
+# Runs pipeline stages that don't depend on the document (e.g. reference data
+# loading) alongside the S3 read and embedding
+_prefetch_pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix="prefetch")
+
+
+@lru_cache(maxsize=1)
+def get_text_splitter():
+    """
+    Shared splitter, built on first use: langchain is slow to import and only
+    needed once a document is actually split, not at service start-up.
+    """
+    from langchain_text_splitters import RecursiveCharacterTextSplitter
+    return RecursiveCharacterTextSplitter(
+        chunk_size=TEXT_CHUNK_SIZE, chunk_overlap=TEXT_CHUNK_OVERLAP)
+
+
+# Shared by every worker thread: the default pool of 10 connections would
+# serialize the bulk upload workers, and long generations outlast the 60s read timeout
+bedrock_config = Config(
+    max_pool_connections=64,
+    retries={"max_attempts": 3, "mode": "adaptive"},
+    tcp_keepalive=True,
+    read_timeout=600
+)
+
 bedrock_runtime = boto3.client(
     service_name='bedrock-runtime',
     aws_access_key_id=AWS['aws_access_key'],
     aws_secret_access_key=AWS['aws_secret_key'],
-    region_name='us-east-1'
+    region_name=BEDROCK_REGION,
+    endpoint_url=BEDROCK_ENDPOINT_URL,
+    config=bedrock_config
+)
+
+# Resolves the same credentials as bedrock_runtime, for signing async requests
+aws_session = boto3.Session(
+    aws_access_key_id=AWS['aws_access_key'],
+    aws_secret_access_key=AWS['aws_secret_key'],
+    region_name=BEDROCK_REGION
 )
 
 
-def split_text(text):
+def split_text(doc):
+    """
+    Chunks of a ParsedDoc: Excel rows as they are, other text split into fragments.
+    Repeated chunks are dropped (first occurrence kept) so they are neither
+    stored twice nor retrieved twice into the prompt; streamed Excel rows are
+    left to the consumer.
+    """
     logger.info("✂️  Dividing the text into fragments...")
     
-    if isinstance(text, dict) and text.get("type") == "excel":
-        logger.info(f"📊 Using Excel rows as chunks: {len(text['chunks'])} rows")
-        return text["chunks"]
+    if doc.kind == "excel":
+        if not isinstance(doc.chunks, list):
+            logger.info("📊 Using streamed Excel rows as chunks")
+            return doc.chunks
+        logger.info(f"📊 Using Excel rows as chunks: {len(doc.chunks)} rows")
+        return dedupe_chunks(doc.chunks)
     
-    text_splitter = RecursiveCharacterTextSplitter(
-        chunk_size=8000, chunk_overlap=1500)
-    return text_splitter.split_text(text)
+    return dedupe_chunks(get_text_splitter().split_text(doc.raw))
+
 
+def dedupe_chunks(chunks):
+    """Drop repeated chunks, keeping the order of first occurrence"""
+    unique = list(dict.fromkeys(chunks))
+    if len(unique) < len(chunks):
+        logger.info(f"♻️ Skipped {len(chunks) - len(unique)} duplicate chunks")
+    return unique
 
-def invoke_model(prompt, max_tokens=5000):
+
+def invoke_model(prompt, max_tokens=5000, cached_prefix=None, tool=None):
+    """
+    Invoke Claude on Bedrock and return the response text.
+
+    cached_prefix, when given, is sent as a separate leading content block marked
+    for prompt caching, so calls that share it (e.g. every batch of one document)
+    only pay full price for the prefix once.
+
+    tool, when given, is a tool definition the model is forced to call; its
+    input_schema describes the expected output and the parsed tool input is
+    returned instead of text, so no JSON repair is needed.
+    """
     try:
         logger.info("🚀 Invoking the model...")
-        request_body = {
-            "anthropic_version": "bedrock-2023-05-31",
-            "max_tokens": max_tokens,
-            "temperature": 0.1,
-            "top_k": 250,
-            "top_p": 0.999,
-            "stop_sequences": [],
-            "messages": [
-                {
-                    "role": "user",
-                    "content": [
-                        {"type": "text", "text": f"{prompt}"}
-                    ]
-                }
-            ]
-        }
-        response = bedrock_runtime.invoke_model(
-            modelId="us.anthropic.claude-3-7-sonnet-20250219-v1:0",
-            body=json.dumps(request_body),
-            contentType="application/json",
-            accept="application/json"
+        response = _call_bedrock(
+            bedrock_runtime.invoke_model,
+            orjson.dumps(_build_request_body(prompt, max_tokens, cached_prefix, tool))
         )
-        return json.loads(response['body'].read())['content'][0]['text']
+        return _response_text(response['body'].read())
 
     except Exception as e:
         logger.error(f"❌ Error invoking the model: {str(e)}")
         raise
 
 
-def is_valid_json(text):
-    """Check if the text is a valid JSON string"""
+def _call_bedrock(operation, body):
+    """
+    Call a Bedrock runtime operation in BEDROCK_LATENCY_MODE, falling back to
+    standard latency when the optimized tier is throttled or not offered.
+    """
+    kwargs = dict(modelId=MODEL_ID, body=body, contentType="application/json", accept="application/json")
+    if BEDROCK_LATENCY_MODE != "optimized":
+        return operation(**kwargs)
+
     try:
-        json.loads(text)
-        return True
-    except json.JSONDecodeError:
-        return False
+        return operation(performanceConfigLatency="optimized", **kwargs)
+    except ClientError as e:
+        if e.response.get("Error", {}).get("Code") not in ("ThrottlingException", "ValidationException"):
+            raise
+        logger.warning(f"⚠️ Latency-optimized inference unavailable ({e.response['Error']['Code']}), retrying with standard latency")
+        return operation(performanceConfigLatency="standard", **kwargs)
+
+
+# Request fields that never change between calls
+_REQUEST_BODY_TEMPLATE = {
+    "anthropic_version": "bedrock-2023-05-31",
+    "temperature": 0.1,
+    "top_k": 250,
+    "top_p": 0.999,
+    "stop_sequences": []
+}
+
+
+@lru_cache(maxsize=8)
+def _encoded_prefix_block(cached_prefix):
+    """
+    The cacheable prefix content block, JSON-encoded once per distinct prefix.
+    The prefix (reference data and instructions) is by far the largest part of
+    the body and is identical for every batch of a document.
+    """
+    return orjson.Fragment(orjson.dumps(
+        {"type": "text", "text": cached_prefix, "cache_control": {"type": "ephemeral"}}))
+
+
+def _build_request_body(prompt, max_tokens, cached_prefix=None, tool=None):
+    content = []
+    if cached_prefix:
+        content.append(_encoded_prefix_block(cached_prefix))
+    content.append({"type": "text", "text": prompt})
+
+    body = {
+        **_REQUEST_BODY_TEMPLATE,
+        "max_tokens": max_tokens,
+        "messages": [
+            {
+                "role": "user",
+                "content": content
+            }
+        ]
+    }
+
+    if tool:
+        body["tools"] = [tool]
+        body["tool_choice"] = {"type": "tool", "name": tool["name"]}
+
+    return body
 
 
+class _ContentBlock(msgspec.Struct):
+    type: str
+    text: str = ""
+    input: dict | None = None
+
+
+class _Usage(msgspec.Struct):
+    cache_read_input_tokens: int = 0
+    cache_creation_input_tokens: int = 0
+
+
+class _BedrockResponse(msgspec.Struct):
+    content: list[_ContentBlock]
+    usage: _Usage = msgspec.field(default_factory=_Usage)
+
+
+_bedrock_response_decoder = msgspec.json.Decoder(_BedrockResponse)
+
+
+def _response_text(payload):
+    """
+    Response text, or the input of the tool call when a tool was forced.
+
+    The raw payload is decoded straight into the fields used here; the rest of
+    the Bedrock envelope (ids, stop reason, ...) is skipped rather than built.
+    """
+    response_body = _bedrock_response_decoder.decode(payload)
+    usage = response_body.usage
+    if usage.cache_read_input_tokens or usage.cache_creation_input_tokens:
+        logger.info(f"💾 Prompt cache: {usage.cache_read_input_tokens} tokens read, {usage.cache_creation_input_tokens} tokens written")
+
+    for block in response_body.content:
+        if block.type == 'tool_use':
+            return block.input
+
+    return response_body.content[0].text
+
+
+def invoke_model_stream(prompt, max_tokens=5000, cached_prefix=None):
+    """
+    Like invoke_model, but yields the response text as Claude generates it,
+    via InvokeModelWithResponseStream.
+    """
+    logger.info("🚀 Invoking the model (streaming)...")
+    response = _call_bedrock(
+        bedrock_runtime.invoke_model_with_response_stream,
+        orjson.dumps(_build_request_body(prompt, max_tokens, cached_prefix))
+    )
+
+    for event in response['body']:
+        chunk = event.get('chunk')
+        if not chunk:
+            continue
+        message = orjson.loads(chunk['bytes'])
+
+        if message['type'] == 'content_block_delta' and message['delta'].get('type') == 'text_delta':
+            yield message['delta']['text']
+        elif message['type'] == 'message_start':
+            usage = message['message'].get('usage', {})
+            if usage.get("cache_read_input_tokens") or usage.get("cache_creation_input_tokens"):
+                logger.info(f"💾 Prompt cache: {usage.get('cache_read_input_tokens', 0)} tokens read, {usage.get('cache_creation_input_tokens', 0)} tokens written")
+
+
+class StreamedResults:
+    """
+    Incrementally picks complete objects out of the top-level "results" array
+    of a JSON response while it is still being streamed.
+    """
+
+    _decoder = json.JSONDecoder()
+
+    def __init__(self):
+        self.buffer = ""
+        self.position = None
+        self.done = False
+
+    def feed(self, text):
+        """Add streamed text and return the results completed by it"""
+        self.buffer += text
+        if self.done:
+            return []
+
+        if self.position is None:
+            start = self.buffer.find('"results"')
+            bracket = self.buffer.find("[", start) if start != -1 else -1
+            if bracket == -1:
+                return []
+            self.position = bracket + 1
+
+        # A result can only have been completed by a delta that closes an object
+        if "}" not in text and "]" not in text:
+            return []
+
+        completed = []
+        while True:
+            while self.position < len(self.buffer) and self.buffer[self.position] in " \t\r\n,":
+                self.position += 1
+            if self.position >= len(self.buffer):
+                break
+            if self.buffer[self.position] == "]":
+                self.done = True
+                break
+            try:
+                result, end = self._decoder.raw_decode(self.buffer, self.position)
+            except ValueError:
+                break
+            completed.append(result)
+            self.position = end
+
+        return completed
+
+
+def create_bedrock_session(max_connections):
+    """aiohttp session for ainvoke_model; share one across all concurrent calls of a job"""
+    ssl_context = ssl.create_default_context(cafile=certifi.where())
+    return aiohttp.ClientSession(
+        connector=aiohttp.TCPConnector(ssl=ssl_context, limit=max_connections),
+        timeout=aiohttp.ClientTimeout(total=600, sock_connect=10)
+    )
+
+
+async def ainvoke_model(session, prompt, max_tokens=5000, cached_prefix=None, tool=None):
+    """
+    Async invoke_model over a shared aiohttp session.
+
+    The request is SigV4-signed with botocore, so hundreds of calls can be in
+    flight on one event loop without a thread per call. Throttling and 5xx
+    responses are retried with exponential backoff. As in _call_bedrock, a
+    throttled or unsupported optimized-latency call is re-sent at standard latency.
+    """
+    body = orjson.dumps(_build_request_body(prompt, max_tokens, cached_prefix, tool))
+    headers = BEDROCK_REQUEST_HEADERS
+
+    attempt = 1
+    while True:
+        request = AWSRequest(
+            method="POST",
+            url=BEDROCK_INVOKE_URL,
+            data=body,
+            headers=headers
+        )
+        credentials = aws_session.get_credentials().get_frozen_credentials()
+        SigV4Auth(credentials, "bedrock", BEDROCK_REGION).add_auth(request)
+
+        error_type = ""
+        try:
+            async with session.post(URL(BEDROCK_INVOKE_URL, encoded=True), data=body, headers=dict(request.headers)) as response:
+                payload = await response.read()
+                status = response.status
+                error_type = response.headers.get("x-amzn-ErrorType", "")
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            if attempt == BEDROCK_MAX_ATTEMPTS:
+                logger.error(f"❌ Error invoking the model: {str(e)}")
+                raise
+            payload, status = str(e).encode("utf-8"), None
+
+        if status == 200:
+            return _response_text(payload)
+
+        if headers is not BEDROCK_STANDARD_HEADERS and (
+                status == 429 or (status == 400 and error_type.startswith("ValidationException"))):
+            logger.warning(f"⚠️ Latency-optimized inference unavailable (HTTP {status}), retrying with standard latency")
+            headers = BEDROCK_STANDARD_HEADERS
+            continue
+
+        if (status is None or status in BEDROCK_RETRY_STATUSES) and attempt < BEDROCK_MAX_ATTEMPTS:
+            wait_time = 2 ** attempt
+            logger.warning(f"⚠️ Bedrock call failed ({status or payload.decode('utf-8', 'replace')}), retrying in {wait_time}s (attempt {attempt}/{BEDROCK_MAX_ATTEMPTS})")
+            await asyncio.sleep(wait_time)
+            attempt += 1
+            continue
+
+        logger.error(f"❌ Error invoking the model: HTTP {status} {payload[:500]!r}")
+        raise RuntimeError(f"Bedrock invoke_model failed with HTTP {status}")
+
+
+def _response_cache_key(prompt, max_tokens, cached_prefix, tool=None):
+    tool_name = tool["name"] if tool else ""
+    return hashlib.sha256(f"{MODEL_ID}:{max_tokens}:{tool_name}:{cached_prefix or ''}:{prompt}".encode("utf-8")).hexdigest()
+
+
+def _get_cached_response(cache_key):
+    with _response_cache_lock:
+        cached = _response_cache.get(cache_key)
+        if cached and time.monotonic() - cached[0] < RESPONSE_CACHE_TTL_SECONDS:
+            _response_cache.move_to_end(cache_key)
+            logger.info("💾 Using cached model response")
+            # Tool inputs are mutated downstream (mapping, batch numbers), so hand out a copy
+            return copy.deepcopy(cached[1]) if isinstance(cached[1], dict) else cached[1]
+    return None
+
+
+def _store_cached_response(cache_key, response_text):
+    with _response_cache_lock:
+        _response_cache[cache_key] = (time.monotonic(), response_text)
+        _response_cache.move_to_end(cache_key)
+        while len(_response_cache) > RESPONSE_CACHE_MAX_ENTRIES:
+            _response_cache.popitem(last=False)
+
+
+def cached_invoke_model(prompt, max_tokens=5000, cached_prefix=None, tool=None):
+    """
+    invoke_model with an in-process LRU/TTL cache keyed on the model, max_tokens and prompt.
+
+    Re-running an identical query (the same document uploaded again, or a
+    repeated batch) returns the previous response instead of calling Bedrock.
+    """
+    cache_key = _response_cache_key(prompt, max_tokens, cached_prefix, tool)
+    if (response_text := _get_cached_response(cache_key)) is not None:
+        return response_text
+
+    response_text = invoke_model(prompt, max_tokens, cached_prefix, tool)
+    _store_cached_response(cache_key, response_text)
+    return response_text
+
+
+async def acached_invoke_model(session, prompt, max_tokens=5000, cached_prefix=None, tool=None):
+    """ainvoke_model sharing cached_invoke_model's response cache"""
+    cache_key = _response_cache_key(prompt, max_tokens, cached_prefix, tool)
+    if (response_text := _get_cached_response(cache_key)) is not None:
+        return response_text
+
+    response_text = await ainvoke_model(session, prompt, max_tokens, cached_prefix, tool)
+    _store_cached_response(cache_key, response_text)
+    return response_text
+
+
+def parse_json_or_none(text):
+    """Parse JSON text in a single pass; returns None if the text is not valid JSON"""
+    try:
+        return orjson.loads(text)
+    except orjson.JSONDecodeError:
+        return None
+
+
+@lru_cache(maxsize=4)
 def initialize_reference_data(bucket_name, file_key_regions, file_key_countries):
-    """Initialize reference data if it doesn't exist"""
+    """
+    Initialize reference data if it doesn't exist.
+
+    Memoized per (bucket, regions file, countries file): once the reference
+    table is known to exist, later requests skip the check entirely.
+    """
     try:
         if check_reference_exists():
             logger.info("✅ Reference data already exists in the database")
@@ -92,26 +466,21 @@ def initialize_reference_data(bucket_name, file_key_regions, file_key_countries)
 
         logger.info("🔄 Initializing reference data...")
 
-        document_content_regions = read_document_from_s3(bucket_name, file_key_regions)
-        document_content_countries = read_document_from_s3(bucket_name, file_key_countries)
+        # Both files are downloaded and parsed at the same time
+        regions_future = _prefetch_pool.submit(read_document_from_s3, bucket_name, file_key_regions, cache=True)
+        countries_future = _prefetch_pool.submit(read_document_from_s3, bucket_name, file_key_countries, cache=True)
+        regions_doc = normalize_document(regions_future.result())
+        countries_doc = normalize_document(countries_future.result())
 
-        if isinstance(document_content_regions, dict) and document_content_regions.get("type") == "excel":
-            regions_chunks = document_content_regions["chunks"]
-        else:
-            regions_chunks = [document_content_regions]
-         
-        if isinstance(document_content_countries, dict) and document_content_countries.get("type") == "excel":
-            countries_chunks = document_content_countries["chunks"]
-        else:
-            countries_chunks = [document_content_countries]
+        regions_chunks = regions_doc.chunks if regions_doc.kind == "excel" else [regions_doc.raw]
+        countries_chunks = countries_doc.chunks if countries_doc.kind == "excel" else [countries_doc.raw]
 
         logger.info(f"📊 Generating embeddings for {len(regions_chunks)} region chunks and {len(countries_chunks)} country chunks...")
-        
-        regions_embeddings = [get_embedding(chunk) for chunk in regions_chunks]
-        countries_embeddings = [get_embedding(chunk) for chunk in countries_chunks]
 
+        # One batch for both files, so all chunks share the embedding worker pool
+        # instead of the countries waiting for the regions to finish
         all_content = regions_chunks + countries_chunks
-        all_embeddings = regions_embeddings + countries_embeddings
+        all_embeddings = get_embeddings_batch(all_content)
 
         store_reference_embeddings(all_content, all_embeddings)
 
@@ -123,14 +492,85 @@ def initialize_reference_data(bucket_name, file_key_regions, file_key_countries)
         raise
 
 
+def map_results_fields(results):
+    """
+    Map the fields of all results with a single mapping service call,
+    falling back to mapping them one by one if the bulk call fails.
+    """
+    try:
+        map_fields_bulk(results, MAPPING_URL)
+        logger.info(f"🔗 Field mapping completed for {len(results)} results")
+        return results
+    except Exception as map_error:
+        logger.warning(f"⚠️ Bulk field mapping failed, mapping results one by one: {str(map_error)}")
+
+    with ThreadPoolExecutor(max_workers=min(8, max(len(results), 1))) as executor:
+        mapped_results = list(executor.map(_safe_map_fields, results))
+    
+    logger.info(f"🔗 Field mapping completed for {len(mapped_results)} results")
+    return mapped_results
+
+
+def _safe_map_fields(result):
+    """map_fields_with_opensearch for one result, returning it unmapped on failure"""
+    try:
+        mapped_result = map_fields_with_opensearch(result, MAPPING_URL)
+        logger.info(f"🔗 Fields mapped for result with indicator: {result.get('indicator', 'Unknown')}")
+        return mapped_result
+    except Exception as map_error:
+        logger.warning(f"⚠️ Field mapping failed for result: {str(map_error)}")
+        return result
+
+
+def invoke_and_map_results(prompt, cached_prefix=None, max_tokens=5000):
+    """
+    Stream the model response and map each result's fields while the rest is
+    still being generated. Returns (response_text, json_content).
+
+    Falls back to mapping the parsed response at the end when the streamed
+    results can't be matched to it (e.g. the model didn't return a results array).
+    """
+    streamed = StreamedResults()
+    parts = []
+
+    with ThreadPoolExecutor(max_workers=4) as map_pool:
+        futures = []
+        for text in invoke_model_stream(prompt, max_tokens, cached_prefix):
+            parts.append(text)
+            for result in streamed.feed(text):
+                if isinstance(result, dict):
+                    futures.append(map_pool.submit(map_fields_with_opensearch, result, MAPPING_URL))
+        mapped_results = []
+        for future in futures:
+            try:
+                mapped_results.append(future.result())
+            except Exception as map_error:
+                logger.warning(f"⚠️ Field mapping failed for streamed result: {str(map_error)}")
+                mapped_results = None
+                break
+
+    response_text = "".join(parts)
+    json_content = parse_json_or_none(response_text)
+    if json_content is None:
+        return response_text, {"text": response_text}
+
+    if isinstance(json_content, dict) and isinstance(json_content.get("results"), list):
+        if mapped_results is not None and len(mapped_results) == len(json_content["results"]):
+            logger.info(f"🔗 Field mapping completed for {len(mapped_results)} streamed results")
+            json_content["results"] = mapped_results
+        else:
+            json_content["results"] = map_results_fields(json_content["results"])
+
+    return response_text, json_content
+
+
 def format_mining_response(raw_response: str) -> Dict[str, Any]:
     """
     Format the mining response to ensure consistent structure with indicator-specific fields
     """
     try:
-        if is_valid_json(raw_response):
-            parsed_response = json.loads(raw_response)
-        else:
+        parsed_response = parse_json_or_none(raw_response)
+        if parsed_response is None:
             logger.warning(f"Invalid JSON received from LLM: {raw_response[:200]}...")
             return {
                 "content": raw_response,
@@ -142,36 +582,19 @@ def format_mining_response(raw_response: str) -> Dict[str, Any]:
         if not isinstance(results, list):
             results = []
         
-        typed_results = []
-        for result in results:
-            indicator = result.get("indicator", "")
-            
-            try:
-                if indicator == "Capacity Sharing for Development":
-                    capacity_result = CapacityDevelopmentResult(**result)
-                    typed_results.append(capacity_result)
-                    
-                elif indicator == "Policy Change":
-                    policy_result = PolicyChangeResult(**result)
-                    typed_results.append(policy_result)
-                    
-                elif indicator == "Innovation Development":
-                    innovation_result = InnovationDevelopmentResult(**result)
-                    typed_results.append(innovation_result)
-                    
-                else:
-                    logger.warning(f"Unknown indicator type: {indicator}")
-                    continue
-                    
-            except Exception as e:
-                logger.error(f"Error processing result with indicator '{indicator}': {str(e)}")
-                continue
-        
-        mining_response = MiningResponse(
-            results=typed_results
-        )
-        
-        return mining_response.model_dump(exclude_none=True)
+        # Validate the whole list in one pass; results that fail (including
+        # unknown indicators) are logged and dropped, the rest re-validated
+        try:
+            typed_results = ResultListAdapter.validate_python(results)
+        except ValidationError as e:
+            failed = {error["loc"][0] for error in e.errors() if error["loc"] and isinstance(error["loc"][0], int)}
+            for index in sorted(failed):
+                indicator = results[index].get("indicator", "") if isinstance(results[index], dict) else ""
+                logger.error(f"Error processing result with indicator '{indicator}': {e.error_count()} validation error(s) in batch")
+            typed_results = ResultListAdapter.validate_python(
+                [result for index, result in enumerate(results) if index not in failed])
+
+        return {"results": ResultListAdapter.dump_python(typed_results, exclude_none=True)}
         
     except Exception as e:
         logger.error(f"Error formatting mining response: {str(e)}")
@@ -182,67 +605,56 @@ def format_mining_response(raw_response: str) -> Dict[str, Any]:
         return error_response.model_dump(exclude_none=True)
 
 
-def process_document(bucket_name, file_key, prompt=DEFAULT_PROMPT_STAR, user_id: str = None):
+def _process_document(bucket_name, file_key, prompt, *, platform, bucket_key_name, user_id: str = None, project=None):
+    """
+    Shared STAR/PRMS pipeline: read, split, embed, retrieve, invoke the model
+    and map fields. platform labels logs and interaction tracking; project,
+    when given, is added to the result.
+    """
     start_time = time.time()
 
     try:
-        reference_file_regions = f"{STAR_BUCKET_KEY_NAME}/clarisa_regions.xlsx"
-        reference_file_countries = f"{STAR_BUCKET_KEY_NAME}/clarisa_countries.xlsx"
+        reference_file_regions = f"{bucket_key_name}/clarisa_regions.xlsx"
+        reference_file_countries = f"{bucket_key_name}/clarisa_countries.xlsx"
         initialize_reference_data(
             bucket_name, reference_file_regions, reference_file_countries)
 
-        document_content = read_document_from_s3(bucket_name, file_key)
-        chunks = split_text(document_content)
-
-        logger.info("#️⃣ Generating embeddings...")
-        embeddings = [get_embedding(chunk) for chunk in chunks]
+        # Independent of the document, so it loads while the document is read and embedded
+        reference_future = _prefetch_pool.submit(get_reference_text)
 
-        db, temp_table_name, document_name = store_temp_embeddings(chunks, embeddings, file_key)
+        doc = normalize_document(read_document_from_s3(bucket_name, file_key))
+        chunks = split_text(doc)
 
-        all_reference_data = get_all_reference_data()
+        logger.info(f"#️⃣ Generating embeddings for {platform}...")
+        embeddings = get_embeddings_batch(chunks)
 
-        relevant_chunks = get_relevant_chunk(prompt, db, temp_table_name, document_name)
+        db, temp_table_name, document_name = store_temp_embeddings(chunks, embeddings, file_key)
 
-        context = all_reference_data + relevant_chunks
+        reference_text = reference_future.result()
 
-        query = f"""
-        Based on this context:\n{context}\n\n
-        Answer the question:\n{prompt}
-        """
+        relevant_chunks = fit_token_budget(
+            get_relevant_chunk(prompt, db, temp_table_name, document_name), MAX_DOCUMENT_CONTEXT_TOKENS)
 
-        response_text = invoke_model(query)
+        query = "".join(("\n".join(relevant_chunks), "\n\nAnswer the question:\n", prompt))
 
-        json_content = json.loads(response_text) if is_valid_json(response_text) else {"text": response_text}
-        
-        if isinstance(json_content, dict) and "results" in json_content:
-            mapped_results = []
-            for result in json_content["results"]:
-                try:
-                    mapped_result = map_fields_with_opensearch(result, MAPPING_URL)
-                    mapped_results.append(mapped_result)
-                    logger.info(f"🔗 Fields mapped for result with indicator: {result.get('indicator', 'Unknown')}")
-                except Exception as map_error:
-                    logger.warning(f"⚠️ Field mapping failed for result: {str(map_error)}")
-                    mapped_results.append(result)
-            
-            json_content["results"] = mapped_results
-            logger.info(f"🔗 Field mapping completed for {len(mapped_results)} results")
+        # The reference data is the same for every document, so it goes first as a cacheable prefix
+        response_text, json_content = invoke_and_map_results(
+            query,
+            cached_prefix="".join(("Based on this context:\n", reference_text, "\n"))
+        )
 
         end_time = time.time()
         elapsed_time = end_time - start_time
 
-        # formatted_response = format_mining_response(
-        #     raw_response=response_text
-        # )
-
         interaction_id = None
+        interaction = None
         if user_id:
             try:
                 user_input = f"Document analysis request for: {file_key}"
-                if isinstance(document_content, dict) and document_content.get("type") == "excel":
-                    user_input += f" (Excel file with {len(document_content.get('chunks', []))} rows)"
+                if doc.kind == "excel":
+                    user_input += f" (Excel file with {len(doc.chunks)} rows)"
                 
-                ai_output = json.dumps(json_content, indent=2, ensure_ascii=False)
+                ai_output = orjson.dumps(json_content, option=orjson.OPT_INDENT_2).decode()
                 
                 tracking_context = {
                     "bucket_name": bucket_name,
@@ -255,155 +667,57 @@ def process_document(bucket_name, file_key, prompt=DEFAULT_PROMPT_STAR, user_id:
                     "processing_steps": ["document_read", "text_splitting", "embedding_generation", "vector_search", "llm_processing", "field_mapping"]
                 }
                 
-                interaction_response = interaction_client.track_interaction(
-                    user_id=user_id,
-                    user_input=user_input,
-                    ai_output=ai_output,
-                    service_name="text-mining",
-                    display_name="STAR Text Mining Service",
-                    service_description="A service that analyzes documents and extracts insights based on user prompts.",
-                    context=tracking_context,
-                    response_time_seconds=elapsed_time,
-                    platform="STAR"
-                )
-
-                if interaction_response:
-                    interaction_id = interaction_response.get('interaction_id')
-                    logger.info(f"📊 Interaction tracked with ID: {interaction_id}")
-                else:
-                    logger.warning("⚠️ Failed to track interaction with interaction service")
+                # Sent by the MCP tool under a pre-assigned ID, before it returns
+                interaction_id = f"req_{uuid.uuid4()}"
+                interaction = {
+                    "interaction_id": interaction_id,
+                    "user_id": user_id,
+                    "user_input": user_input,
+                    "ai_output": ai_output,
+                    "service_name": "text-mining",
+                    "display_name": f"{platform} Text Mining Service",
+                    "service_description": "A service that analyzes documents and extracts insights based on user prompts.",
+                    "context": tracking_context,
+                    "response_time_seconds": elapsed_time,
+                    "platform": platform
+                }
+                logger.info(f"📊 Interaction prepared for tracking with ID: {interaction_id}")
 
             except Exception as tracking_error:
                 logger.error(f"❌ Error tracking interaction: {str(tracking_error)}")
 
-        # logger.info(f"✅ Successfully generated response:\n{json.dumps(formatted_response, indent=2)}")
-        logger.info(f"✅ Successfully generated response:\n{json.dumps(json_content, indent=2, ensure_ascii=False)}")
-        logger.info(f"⏱️ Response time: {elapsed_time:.2f} seconds")
+        logger.info(f"✅ Successfully generated {platform} response")
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("📦 %s response content:\n%s", platform, orjson.dumps(json_content, option=orjson.OPT_INDENT_2).decode())
+        logger.info(f"⏱️ {platform} Response time: {elapsed_time:.2f} seconds")
 
         result = {
             "content": response_text,
             "time_taken": f"{elapsed_time:.2f}",
             "json_content": json_content
-            # "json_content": formatted_response
         }
+
+        if project:
+            result["project"] = project
         
         if interaction_id:
             result["interaction_id"] = interaction_id
+            result["interaction"] = interaction
         
         return result
 
     except Exception as e:
-        logger.error(f"❌ Error: {str(e)}")
+        logger.error(f"❌ {platform} Error: {str(e)}")
         raise
 
 
-def process_document_prms(bucket_name, file_key, prompt=DEFAULT_PROMPT_PRMS, user_id: str = None):
-    """Process document for PRMS project - identical functionality to process_document"""
-    start_time = time.time()
-    logger.info(f"PRMS Processing: {prompt}")
-
-    try:
-        reference_file_regions = f"{PRMS_BUCKET_KEY_NAME}/clarisa_regions.xlsx"
-        reference_file_countries = f"{PRMS_BUCKET_KEY_NAME}/clarisa_countries.xlsx"
-        initialize_reference_data(
-            bucket_name, reference_file_regions, reference_file_countries)
-
-        document_content = read_document_from_s3(bucket_name, file_key)
-        chunks = split_text(document_content)
-
-        logger.info("#️⃣ Generating embeddings for PRMS...")
-        embeddings = [get_embedding(chunk) for chunk in chunks]
-
-        db, temp_table_name, document_name = store_temp_embeddings(chunks, embeddings, file_key)
-
-        all_reference_data = get_all_reference_data()
-
-        relevant_chunks = get_relevant_chunk(prompt, db, temp_table_name, document_name)
-
-        context = all_reference_data + relevant_chunks
-
-        query = f"""
-        Based on this context:\n{context}\n\n
-        Answer the question:\n{prompt}
-        """
-
-        response_text = invoke_model(query)
-
-        json_content = json.loads(response_text) if is_valid_json(response_text) else {"text": response_text}
-        
-        if isinstance(json_content, dict) and "results" in json_content:
-            mapped_results = []
-            for result in json_content["results"]:
-                try:
-                    mapped_result = map_fields_with_opensearch(result, MAPPING_URL)
-                    mapped_results.append(mapped_result)
-                    logger.info(f"🔗 Fields mapped for result with indicator: {result.get('indicator', 'Unknown')}")
-                except Exception as map_error:
-                    logger.warning(f"⚠️ Field mapping failed for result: {str(map_error)}")
-                    mapped_results.append(result)
-            
-            json_content["results"] = mapped_results
-            logger.info(f"🔗 Field mapping completed for {len(mapped_results)} results")
-
-        end_time = time.time()
-        elapsed_time = end_time - start_time
-
-        interaction_id = None
-        if user_id:
-            try:
-                user_input = f"Document analysis request for: {file_key}"
-                if isinstance(document_content, dict) and document_content.get("type") == "excel":
-                    user_input += f" (Excel file with {len(document_content.get('chunks', []))} rows)"
-                
-                ai_output = json.dumps(json_content, indent=2, ensure_ascii=False)
-                
-                tracking_context = {
-                    "bucket_name": bucket_name,
-                    "file_key": file_key,
-                    "prompt_used": prompt[:500] + "..." if len(prompt) > 500 else prompt,
-                    "prompt_full_length": len(prompt),
-                    "chunks_processed": len(chunks),
-                    "results_count": len(json_content.get("results", [])),
-                    "model_used": "claude-4-sonnet",
-                    "processing_steps": ["document_read", "text_splitting", "embedding_generation", "vector_search", "llm_processing", "field_mapping"]
-                }
-                
-                interaction_response = interaction_client.track_interaction(
-                    user_id=user_id,
-                    user_input=user_input,
-                    ai_output=ai_output,
-                    service_name="text-mining",
-                    display_name="PRMS Text Mining Service",
-                    service_description="A service that analyzes documents and extracts insights based on user prompts.",
-                    context=tracking_context,
-                    response_time_seconds=elapsed_time,
-                    platform="PRMS"
-                )
-
-                if interaction_response:
-                    interaction_id = interaction_response.get('interaction_id')
-                    logger.info(f"📊 Interaction tracked with ID: {interaction_id}")
-                else:
-                    logger.warning("⚠️ Failed to track interaction with interaction service")
-
-            except Exception as tracking_error:
-                logger.error(f"❌ Error tracking interaction: {str(tracking_error)}")
-        
-        logger.info(f"✅ Successfully generated PRMS response:\n{json.dumps(json_content, indent=2, ensure_ascii=False)}")
-        logger.info(f"⏱️ PRMS Response time: {elapsed_time:.2f} seconds")
-
-        result = {
-            "content": response_text,
-            "time_taken": f"{elapsed_time:.2f}",
-            "json_content": json_content,
-            "project": "PRMS"
-        }
+def process_document(bucket_name, file_key, prompt=DEFAULT_PROMPT_STAR, user_id: str = None):
+    return _process_document(bucket_name, file_key, prompt, platform="STAR",
+                             bucket_key_name=STAR_BUCKET_KEY_NAME, user_id=user_id)
 
-        if interaction_id:
-            result["interaction_id"] = interaction_id
-        
-        return result
 
-    except Exception as e:
-        logger.error(f"❌ PRMS Error: {str(e)}")
-        raise
\ No newline at end of file
+def process_document_prms(bucket_name, file_key, prompt=DEFAULT_PROMPT_PRMS, user_id: str = None):
+    """Process document for PRMS project - identical functionality to process_document"""
+    logger.debug("PRMS Processing: %s", prompt)
+    return _process_document(bucket_name, file_key, prompt, platform="PRMS",
+                             bucket_key_name=PRMS_BUCKET_KEY_NAME, user_id=user_id, project="PRMS")
@@ -1,42 +1,84 @@
 import time
-import json
 import boto3
+import orjson
+from botocore.config import Config
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
 from app.utils.logger.logger_util import get_logger
 from app.utils.s3.s3_util import read_document_from_s3
+from app.utils.tokens.token_util import fit_token_budget
 from app.utils.prompt.prompt_star import DEFAULT_PROMPT_STAR
 from app.utils.prompt.prompt_prms import DEFAULT_PROMPT_PRMS
-from langchain_text_splitters import RecursiveCharacterTextSplitter
-from app.utils.config.config_util import AWS, STAR_BUCKET_KEY_NAME, PRMS_BUCKET_KEY_NAME
-from app.llm.vectorize_supabase import (get_embedding,
+from app.utils.config.config_util import (AWS, STAR_BUCKET_KEY_NAME, PRMS_BUCKET_KEY_NAME, MAX_DOCUMENT_CONTEXT_TOKENS,
+                                          TEXT_CHUNK_SIZE, TEXT_CHUNK_OVERLAP, BEDROCK_REGION, BEDROCK_ENDPOINT_URL,
+                                          BEDROCK_MODEL_ID)
+from app.llm.vectorize_supabase import (get_embeddings_batch,
                                store_reference_embeddings,
                                store_temp_embeddings,
                                get_all_reference_data,
                                get_relevant_chunk,
                                initialize_supabase_tables,
-                               get_connection
+                               pooled_connection
                                )
 
 
 logger = get_logger()
 
+# Runs document-independent stages (reference data loading) alongside the S3 read and embedding
+_prefetch_pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix="prefetch")
+
+# Set once the reference rows are known to exist; they are never removed while the process runs
+_reference_data_ready = False
+
 bedrock_runtime = boto3.client(
     service_name='bedrock-runtime',
     aws_access_key_id=AWS['aws_access_key'],
     aws_secret_access_key=AWS['aws_secret_key'],
-    region_name='us-east-1'
+    region_name=BEDROCK_REGION,
+    endpoint_url=BEDROCK_ENDPOINT_URL,
+    config=Config(
+        max_pool_connections=50,
+        retries={"max_attempts": 5, "mode": "adaptive"},
+        tcp_keepalive=True,
+        connect_timeout=3,
+        read_timeout=600
+    )
 )
 
 
+@lru_cache(maxsize=1)
+def get_text_splitter():
+    """Shared splitter, built on first use so langchain isn't imported at start-up"""
+    from langchain_text_splitters import RecursiveCharacterTextSplitter
+    return RecursiveCharacterTextSplitter(
+        chunk_size=TEXT_CHUNK_SIZE, chunk_overlap=TEXT_CHUNK_OVERLAP)
+
+
 def split_text(text):
+    """Split text into fragments, dropping repeated ones (first occurrence kept)"""
     logger.info("✂️  Dividing the text into fragments...")
-    text_splitter = RecursiveCharacterTextSplitter(
-        chunk_size=8000, chunk_overlap=1500)
-    return text_splitter.split_text(text)
+    chunks = get_text_splitter().split_text(text)
+    unique = list(dict.fromkeys(chunks))
+    if len(unique) < len(chunks):
+        logger.info(f"♻️ Skipped {len(chunks) - len(unique)} duplicate chunks")
+    return unique
+
 
+def invoke_model(prompt, cached_prefix=None):
+    """
+    Invoke Claude on Bedrock and return the response text.
 
-def invoke_model(prompt):
+    cached_prefix (the reference data, identical for every request) is sent as
+    its own content block marked for prompt caching, so it isn't prefilled again
+    on every call.
+    """
     try:
         logger.info("🚀 Invoking the model...")
+        content = []
+        if cached_prefix:
+            content.append({"type": "text", "text": cached_prefix, "cache_control": {"type": "ephemeral"}})
+        content.append({"type": "text", "text": prompt})
+
         request_body = {
             "anthropic_version": "bedrock-2023-05-31",
             "max_tokens": 3000,
@@ -47,62 +89,65 @@ def invoke_model(prompt):
             "messages": [
                 {
                     "role": "user",
-                    "content": [
-                        {"type": "text", "text": f"{prompt}"}
-                    ]
+                    "content": content
                 }
             ]
         }
         response = bedrock_runtime.invoke_model(
-            modelId="us.anthropic.claude-3-7-sonnet-20250219-v1:0",
-            body=json.dumps(request_body),
+            modelId=BEDROCK_MODEL_ID,
+            body=orjson.dumps(request_body),
             contentType="application/json",
             accept="application/json"
         )
-        return json.loads(response['body'].read())['content'][0]['text']
+        return orjson.loads(response['body'].read())['content'][0]['text']
 
     except Exception as e:
         logger.error(f"❌ Error invoking the model: {str(e)}")
         raise
 
 
-def is_valid_json(text):
-    """Check if the text is a valid JSON string"""
+def parse_json_or_none(text):
+    """Parse JSON text in a single pass; returns None if the text is not valid JSON"""
     try:
-        json.loads(text)
-        return True
-    except json.JSONDecodeError:
-        return False
+        return orjson.loads(text)
+    except orjson.JSONDecodeError:
+        return None
 
 
 def initialize_reference_data(bucket_name, file_key_regions, file_key_countries):
     """Initialize reference data if it doesn't exist"""
+    global _reference_data_ready
+    if _reference_data_ready:
+        return True
+
     try:
-        conn = get_connection()
-        cur = conn.cursor()
-        cur.execute("SELECT COUNT(*) FROM reference_embeddings")
-        count = cur.fetchone()[0]
-        cur.close()
-        conn.close()
+        with pooled_connection() as conn:
+            cur = conn.cursor()
+            cur.execute("SELECT COUNT(*) FROM reference_embeddings")
+            count = cur.fetchone()[0]
+            cur.close()
 
         if count == 2:
             logger.info("✅ Reference data already exists in the database. Skipping initialization.")
+            _reference_data_ready = True
             return True
         
         logger.info("🔄 Initializing reference data...")
 
         document_content_regions = read_document_from_s3(
-            bucket_name, file_key_regions)
-        regions_embeddings = get_embedding(document_content_regions)
-
+            bucket_name, file_key_regions, cache=True)
         document_content_countries = read_document_from_s3(
-            bucket_name, file_key_countries)
-        countries_embeddings = get_embedding(document_content_countries)
+            bucket_name, file_key_countries, cache=True)
+
+        regions_embeddings, countries_embeddings = get_embeddings_batch(
+            [document_content_regions, document_content_countries])
 
-        store_reference_embeddings(document_content_regions, regions_embeddings)
-        store_reference_embeddings(document_content_countries, countries_embeddings)
+        store_reference_embeddings(
+            [document_content_regions, document_content_countries],
+            [regions_embeddings, countries_embeddings])
 
         logger.info("✅ Reference data initialized successfully")
+        _reference_data_ready = True
         return True
 
     except Exception as e:
@@ -110,98 +155,67 @@ def initialize_reference_data(bucket_name, file_key_regions, file_key_countries)
         raise
 
 
-def process_document(bucket_name, file_key, prompt=DEFAULT_PROMPT_STAR):
+def _process_document(bucket_name, file_key, prompt, *, platform, bucket_key_name, project=None):
+    """Shared STAR/PRMS pipeline on Supabase; project, when given, is added to the result"""
     start_time = time.time()
 
     try:
-        reference_file_regions = f"{STAR_BUCKET_KEY_NAME}/clarisa_regions.xlsx"
-        reference_file_countries = f"{STAR_BUCKET_KEY_NAME}/clarisa_countries.xlsx"
+        reference_file_regions = f"{bucket_key_name}/clarisa_regions.xlsx"
+        reference_file_countries = f"{bucket_key_name}/clarisa_countries.xlsx"
         initialize_supabase_tables()
         initialize_reference_data(
             bucket_name, reference_file_regions, reference_file_countries)
 
+        # Independent of the document, so it loads while the document is read and embedded
+        reference_future = _prefetch_pool.submit(get_all_reference_data)
+
         document_content = read_document_from_s3(bucket_name, file_key)
         chunks = split_text(document_content)
 
-        logger.info("#️⃣ Generating embeddings...")
-        embeddings = [get_embedding(chunk) for chunk in chunks]
+        logger.info(f"#️⃣ Generating embeddings for {platform}...")
+        embeddings = get_embeddings_batch(chunks)
 
         document_name = store_temp_embeddings(chunks, embeddings, file_key)
 
-        all_reference_data = get_all_reference_data()
-
-        relevant_chunks = get_relevant_chunk(prompt, document_name)
+        all_reference_data = reference_future.result()
 
-        context = all_reference_data + relevant_chunks
+        relevant_chunks = fit_token_budget(get_relevant_chunk(prompt, document_name), MAX_DOCUMENT_CONTEXT_TOKENS)
 
-        query = f"""
-        Based on this context:\n{context}\n\n
-        Answer the question:\n{prompt}
-        """
+        reference_block = "".join(("Based on this context:\n", "\n".join(all_reference_data), "\n"))
+        dynamic_block = "".join(("\n".join(relevant_chunks), "\n\nAnswer the question:\n", prompt))
 
-        response_text = invoke_model(query)
+        response_text = invoke_model(dynamic_block, cached_prefix=reference_block)
 
         end_time = time.time()
         elapsed_time = end_time - start_time
-        logger.info(f"✅ Successfully generated response:\n{response_text}")
-        logger.info(f"⏱️ Response time: {elapsed_time:.2f} seconds")
+        logger.info(f"✅ Successfully generated {platform} response:\n{response_text}")
+        logger.info(f"⏱️ {platform} Response time: {elapsed_time:.2f} seconds")
+
+        json_content = parse_json_or_none(response_text)
 
-        return {
+        result = {
             "content": response_text,
             "time_taken": f"{elapsed_time:.2f}",
-            "json_content": json.loads(response_text) if is_valid_json(response_text) else {"text": response_text}
+            "json_content": json_content if json_content is not None else {"text": response_text}
         }
 
+        if project:
+            result["project"] = project
+
+        return result
+
     except Exception as e:
-        logger.error(f"❌ Error: {str(e)}")
+        logger.error(f"❌ {platform} Error: {str(e)}")
         raise
 
 
+def process_document(bucket_name, file_key, prompt=DEFAULT_PROMPT_STAR):
+    return _process_document(bucket_name, file_key, prompt, platform="STAR",
+                             bucket_key_name=STAR_BUCKET_KEY_NAME)
+
+
 def process_document_prms(bucket_name, file_key, prompt=DEFAULT_PROMPT_PRMS):
     """Process document for PRMS project using Supabase - identical functionality to process_document"""
-    start_time = time.time()
     logger.info(f"PRMS Supabase Processing: {prompt}")
-
-    try:
-        reference_file_regions = f"{PRMS_BUCKET_KEY_NAME}/clarisa_regions.xlsx"
-        reference_file_countries = f"{PRMS_BUCKET_KEY_NAME}/clarisa_countries.xlsx"
-        initialize_supabase_tables()
-        initialize_reference_data(
-            bucket_name, reference_file_regions, reference_file_countries)
-
-        document_content = read_document_from_s3(bucket_name, file_key)
-        chunks = split_text(document_content)
-
-        logger.info("#️⃣ Generating embeddings for PRMS...")
-        embeddings = [get_embedding(chunk) for chunk in chunks]
-
-        document_name = store_temp_embeddings(chunks, embeddings, file_key)
-
-        all_reference_data = get_all_reference_data()
-
-        relevant_chunks = get_relevant_chunk(prompt, document_name)
-
-        context = all_reference_data + relevant_chunks
-
-        query = f"""
-        Based on this context:\n{context}\n\n
-        Answer the question:\n{prompt}
-        """
-
-        response_text = invoke_model(query)
-
-        end_time = time.time()
-        elapsed_time = end_time - start_time
-        logger.info(f"✅ Successfully generated PRMS response:\n{response_text}")
-        logger.info(f"⏱️ PRMS Response time: {elapsed_time:.2f} seconds")
-
-        return {
-            "content": response_text,
-            "time_taken": f"{elapsed_time:.2f}",
-            "json_content": json.loads(response_text) if is_valid_json(response_text) else {"text": response_text},
-            "project": "PRMS"
-        }
-
-    except Exception as e:
-        logger.error(f"❌ PRMS Error: {str(e)}")
-        raise
\ No newline at end of file
+    return _process_document(bucket_name, file_key, prompt, platform="PRMS",
+                             bucket_key_name=PRMS_BUCKET_KEY_NAME, project="PRMS")
@@ -1,12 +1,24 @@
-import re
-import json
+import orjson
+import time
 import boto3
+from botocore.config import Config
+import sqlite3
+import hashlib
+import re
 import lancedb
-import unicodedata
+import threading
+import numpy as np
+import pyarrow as pa
+from array import array
 from pathlib import Path
+from collections import OrderedDict
 from datetime import datetime
-from app.utils.config.config_util import AWS
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
+from app.utils.config.config_util import (AWS, EMBEDDING_MAX_CONCURRENCY, EMBEDDING_DIMENSIONS, BEDROCK_REGION,
+                                          BEDROCK_ENDPOINT_URL)
 from app.utils.logger.logger_util import get_logger
+from app.utils.strings.string_util import normalize_filename
 import os
 
 
@@ -24,15 +36,66 @@ logger.info(f"Production mode: DB path set to {DB_PATH}")
 
 REFERENCE_TABLE_NAME = "clarisa_reference"
 TEMP_TABLE_NAME = "temp_documents"
-
-
+EMBEDDING_MODEL_ID = "amazon.titan-embed-text-v2:0"
+EMBEDDING_MAX_WORKERS = EMBEDDING_MAX_CONCURRENCY
+EMBEDDING_MEMORY_CACHE_SIZE = 10_000
+EMBEDDING_CACHE_PATH = str(Path(DB_PATH) / "embedding_cache.sqlite")
+REFERENCE_CACHE_TTL_SECONDS = 24 * 60 * 60
+# IVF_PQ needs enough rows to train 256 partitions; smaller tables are scanned exactly
+VECTOR_INDEX_MIN_ROWS = 65_536
+VECTOR_INDEX_PARTITIONS = 256
+VECTOR_INDEX_SUB_VECTORS = 64
+VECTOR_SEARCH_NPROBES = 20
+# Candidates fetched per result from the quantized index and re-ranked on the full vectors
+VECTOR_SEARCH_REFINE_FACTOR = 4
+# Every request appends and then deletes its rows, leaving small fragments and
+# deletion files behind; the temp table is compacted after this many deletes
+TEMP_COMPACT_EVERY_DELETES = 50
+
+# db_path -> (loaded_at, reference texts); the CLARISA reference table rarely changes
+_reference_data_cache = {}
+# db_path -> (loaded_at, newline-joined reference texts) for prompt prefixes
+_reference_text_cache = {}
+_document_name_index_ready = False
+
+_temp_deletes_since_compaction = 0
+_temp_deletes_lock = threading.Lock()
+# Serializes writes to the temp table (add/delete/drop) with its background
+# compaction, which would otherwise fail them with commit conflicts
+_temp_table_lock = threading.Lock()
+# One compaction at a time, off the request path
+_compaction_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="lancedb-compact")
+
+# What store_temp_embeddings produces (normalize_filename + timestamp)
+_DOCUMENT_NAME_RE = re.compile(r'^[a-zA-Z0-9_\-.]+$')
+
+
+# Shared by the embedding worker threads; adaptive retries absorb Titan throttling
 bedrock_runtime = boto3.client(
     service_name='bedrock-runtime',
     aws_access_key_id=AWS['aws_access_key'],
     aws_secret_access_key=AWS['aws_secret_key'],
-    region_name='us-east-1'
+    region_name=BEDROCK_REGION,
+    endpoint_url=BEDROCK_ENDPOINT_URL,
+    config=Config(
+        max_pool_connections=50,
+        retries={"max_attempts": 5, "mode": "adaptive"},
+        tcp_keepalive=True,
+        connect_timeout=3,
+        read_timeout=60
+    )
 )
 
+# Embeddings keyed by a digest of (model, text): an in-process LRU of float32
+# arrays in front of a SQLite file that outlives the process (e.g. MCP server
+# restarts), so unchanged reference rows and documents are never re-embedded.
+_embedding_memory_cache = OrderedDict()
+_embedding_cache_lock = threading.Lock()
+_embedding_db = sqlite3.connect(EMBEDDING_CACHE_PATH, check_same_thread=False, timeout=30)
+_embedding_db.execute("PRAGMA journal_mode=WAL")
+_embedding_db.execute("CREATE TABLE IF NOT EXISTS embeddings (digest TEXT PRIMARY KEY, vector BLOB NOT NULL)")
+_embedding_db.commit()
+
 
 def get_embedding(text):
     try:
@@ -52,15 +115,16 @@ def get_embedding(text):
             text = "Empty document"
         
         request_body = {
-            "inputText": text
+            "inputText": text,
+            "dimensions": EMBEDDING_DIMENSIONS
         }
         response = bedrock_runtime.invoke_model(
-            modelId="amazon.titan-embed-text-v2:0",
-            body=json.dumps(request_body),
+            modelId=EMBEDDING_MODEL_ID,
+            body=orjson.dumps(request_body),
             contentType="application/json",
             accept="application/json"
         )
-        response_body = json.loads(response['body'].read())
+        response_body = orjson.loads(response['body'].read())
         embeddings = response_body['embedding']
 
         return embeddings
@@ -69,33 +133,162 @@ def get_embedding(text):
         raise
 
 
+def _embedding_digest(text):
+    """Cache key for a text, or None if the text is not cacheable"""
+    if not isinstance(text, str) or not text.strip():
+        return None
+    return hashlib.blake2b(f"{EMBEDDING_MODEL_ID}:{EMBEDDING_DIMENSIONS}\0{text}".encode("utf-8"), digest_size=20).hexdigest()
+
+
+def _remember_embeddings(vectors_by_digest):
+    """Add vectors to the in-process LRU (caller holds _embedding_cache_lock)"""
+    for digest, vector in vectors_by_digest.items():
+        _embedding_memory_cache[digest] = vector
+        _embedding_memory_cache.move_to_end(digest)
+    while len(_embedding_memory_cache) > EMBEDDING_MEMORY_CACHE_SIZE:
+        _embedding_memory_cache.popitem(last=False)
+
+
+def _load_cached_embeddings(digests, page_size=500):
+    """Look several digests up at once: memory first, then one query per page of the rest"""
+    found = {}
+    with _embedding_cache_lock:
+        for digest in digests:
+            vector = _embedding_memory_cache.get(digest)
+            if vector is not None:
+                _embedding_memory_cache.move_to_end(digest)
+                found[digest] = vector
+
+        remaining = [digest for digest in digests if digest not in found]
+        from_disk = {}
+        for i in range(0, len(remaining), page_size):
+            page = remaining[i:i + page_size]
+            placeholders = ",".join("?" * len(page))
+            for digest, blob in _embedding_db.execute(
+                    f"SELECT digest, vector FROM embeddings WHERE digest IN ({placeholders})", page):
+                vector = array('f')
+                vector.frombytes(blob)
+                from_disk[digest] = vector
+
+        _remember_embeddings(from_disk)
+
+    found.update(from_disk)
+    return found
+
+
+def _store_embeddings(vectors_by_digest):
+    """Persist new vectors in a single transaction"""
+    if not vectors_by_digest:
+        return
+    with _embedding_cache_lock:
+        _embedding_db.executemany(
+            "INSERT OR REPLACE INTO embeddings (digest, vector) VALUES (?, ?)",
+            [(digest, vector.tobytes()) for digest, vector in vectors_by_digest.items()]
+        )
+        _embedding_db.commit()
+        _remember_embeddings(vectors_by_digest)
+
+
+def get_embedding_cached(text):
+    """get_embedding backed by the memory and on-disk embedding caches"""
+    return get_embeddings_batch([text])[0]
+
+
+def get_embeddings_batch(texts, max_workers=EMBEDDING_MAX_WORKERS):
+    """
+    Generate embeddings for several texts, returned in the same order as the input.
+
+    The embedding cache is checked for the whole batch at once and identical
+    texts are embedded only once. Titan v2 only embeds one input per request,
+    so the remaining requests are issued concurrently instead of paying one
+    round-trip after another, and their vectors are cached in one transaction.
+    """
+    texts = list(texts)
+    digests = [_embedding_digest(text) for text in texts]
+    cached = _load_cached_embeddings(list({digest for digest in digests if digest}))
+
+    vectors = [None] * len(texts)
+    # digest (or position, for uncacheable texts) -> positions sharing that text
+    missing = {}
+    for i, digest in enumerate(digests):
+        if digest in cached:
+            vectors[i] = cached[digest].tolist()
+        else:
+            missing.setdefault(digest or i, []).append(i)
+
+    if missing:
+        keys = list(missing)
+        to_embed = [texts[missing[key][0]] for key in keys]
+
+        if len(to_embed) == 1:
+            embedded = [get_embedding(to_embed[0])]
+        else:
+            workers = min(max_workers, len(to_embed))
+            logger.info(f"#️⃣ Generating {len(to_embed)} embeddings with {workers} workers ({len(texts) - len(to_embed)} cached or repeated)...")
+            embedded = _embed_concurrently(to_embed, workers)
+
+        new_vectors = {}
+        for key, embedding in zip(keys, embedded):
+            for i in missing[key]:
+                vectors[i] = embedding
+            if isinstance(key, str):
+                new_vectors[key] = array('f', embedding)
+        _store_embeddings(new_vectors)
+
+    return vectors
+
+
+def _embed_concurrently(texts, workers):
+    """
+    Embed texts on a thread pool, in input order. Texts whose request fails
+    (typically throttling once the pool outruns the account's TPS quota) are
+    retried one at a time afterwards instead of failing the whole batch.
+    """
+    embedded = [None] * len(texts)
+    failed = []
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(get_embedding, text) for text in texts]
+        for i, future in enumerate(futures):
+            try:
+                embedded[i] = future.result()
+            except Exception:
+                failed.append(i)
+
+    if failed:
+        logger.warning(f"⚠️ {len(failed)} of {len(texts)} embeddings failed concurrently, retrying them sequentially...")
+        for i in failed:
+            embedded[i] = get_embedding(texts[i])
+
+    return embedded
+
+
+@lru_cache(maxsize=4)
+def get_db(db_path=DB_PATH):
+    """One LanceDB connection per path for the life of the process"""
+    return lancedb.connect(db_path)
+
+
 def check_reference_exists(db_path=DB_PATH):
     """Check if reference table already exists in the database"""
     try:
-        db = lancedb.connect(db_path)
+        db = get_db(db_path)
         return REFERENCE_TABLE_NAME in db.table_names()
     except Exception as e:
         logger.error(f"❌ Error checking reference table: {str(e)}")
         return False
 
 
-def normalize_filename(filename):
-    filename = unicodedata.normalize('NFKD', filename)
-    filename = filename.encode('ASCII', 'ignore').decode('utf-8')
-    filename = filename.lower().replace(" ", "_")
-    filename = re.sub(r'[^a-z0-9_\-\.]', '', filename)
-
-    return filename
-
-
 def store_reference_embeddings(chunks, embeddings, db_path=DB_PATH):
     """Store reference data embeddings that should persist"""
     try:
         logger.info("💾 Storing reference embeddings in LanceDB...")
-        db = lancedb.connect(db_path)
+        db = get_db(db_path)
 
-        data = [{"text": chunk, "vector": embedding, "is_reference": True}
-                for chunk, embedding in zip(chunks, embeddings)]
+        data = pa.table({
+            "text": list(chunks),
+            "vector": _vector_column(embeddings),
+            "is_reference": [True] * len(chunks)
+        })
 
         if REFERENCE_TABLE_NAME not in db.table_names():
             db.create_table(REFERENCE_TABLE_NAME, data=data)
@@ -118,19 +311,34 @@ def store_temp_embeddings(chunks, embeddings, file_key, db_path=DB_PATH):
         document_name = f"{s_file_key}_{timestamp}"
 
         logger.info("💾 Storing temporary document embeddings in LanceDB...")
-        db = lancedb.connect(db_path)
-
-        data = [{"text": chunk, "vector": embedding, "is_reference": False, "document_name": document_name}
-                for chunk, embedding in zip(chunks, embeddings)]
+        db = get_db(db_path)
+
+        data = pa.table({
+            "text": list(chunks),
+            "vector": _vector_column(embeddings),
+            "is_reference": [False] * len(chunks),
+            "document_name": [document_name] * len(chunks)
+        })
+
+        with _temp_table_lock:
+            if TEMP_TABLE_NAME in db.table_names():
+                table = db.open_table(TEMP_TABLE_NAME)
+                if table.schema.field("vector").type.list_size != EMBEDDING_DIMENSIONS:
+                    # Written with another embedding size; the rows are only temporary
+                    logger.info(f"🔄 Recreating temporary table for {EMBEDDING_DIMENSIONS}-dimension vectors")
+                    db.drop_table(TEMP_TABLE_NAME)
+                    _reset_temp_table_state()
+
+            if TEMP_TABLE_NAME not in db.table_names():
+                table = db.create_table(TEMP_TABLE_NAME, data=data)
+                logger.info(f"✅ Created temporary table with {len(data)} entries")
+            else:
+                table.add(data)
+                logger.info(
+                    f"✅ Appended {len(data)} entries to existing temporary table")
 
-        if TEMP_TABLE_NAME not in db.table_names():
-            table = db.create_table(TEMP_TABLE_NAME, data=data)
-            logger.info(f"✅ Created temporary table with {len(data)} entries")
-        else:
-            table = db.open_table(TEMP_TABLE_NAME)
-            table.add(data)
-            logger.info(
-                f"✅ Appended {len(data)} entries to existing temporary table")
+        ensure_document_name_index(table)
+        ensure_vector_index(table)
 
         return db, TEMP_TABLE_NAME, document_name
     except Exception as e:
@@ -138,40 +346,172 @@ def store_temp_embeddings(chunks, embeddings, file_key, db_path=DB_PATH):
         raise
 
 
+def _reset_temp_table_state():
+    """Forget what was known about the dropped temp table, so the new one gets its own indexes"""
+    global _document_name_index_ready, _temp_deletes_since_compaction
+    _document_name_index_ready = False
+    with _temp_deletes_lock:
+        _temp_deletes_since_compaction = 0
+
+
+def _unit_vectors(embeddings):
+    """float32 rows scaled to unit length, so the dot product ranks like cosine similarity"""
+    vectors = np.asarray(embeddings, dtype=np.float32).reshape(-1, EMBEDDING_DIMENSIONS)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.where(norms == 0, 1, norms)
+
+
+def _vector_column(embeddings):
+    """Embeddings as a fixed-size float32 list column instead of per-row Python float lists"""
+    return pa.FixedSizeListArray.from_arrays(pa.array(_unit_vectors(embeddings).ravel()), EMBEDDING_DIMENSIONS)
+
+
+def ensure_document_name_index(table):
+    """
+    BTREE index on document_name, so the per-document filter in
+    get_relevant_chunk is applied before the vector search instead of after it.
+    Checked once per process, and again after the temp table is recreated.
+    """
+    global _document_name_index_ready
+    if _document_name_index_ready:
+        return
+    try:
+        if not any("document_name" in index.columns for index in table.list_indices()):
+            table.create_scalar_index("document_name", index_type="BTREE")
+            logger.info("🗂️ Created scalar index on document_name")
+        _document_name_index_ready = True
+    except Exception as e:
+        logger.warning(f"⚠️ Could not build document_name index: {str(e)}")
+
+
+def ensure_vector_index(table):
+    """
+    Build an IVF_PQ index on the vector column once the table is large enough
+    for the quantized search to pay off. Rows added afterwards are still found:
+    LanceDB scans unindexed rows exactly alongside the index.
+    """
+    try:
+        if any("vector" in index.columns for index in table.list_indices()):
+            return
+        row_count = table.count_rows()
+        if row_count < VECTOR_INDEX_MIN_ROWS:
+            return
+
+        logger.info(f"🗂️ Building IVF_PQ vector index over {row_count} rows...")
+        table.create_index(
+            metric="dot",
+            vector_column_name="vector",
+            index_type="IVF_PQ",
+            num_partitions=VECTOR_INDEX_PARTITIONS,
+            num_sub_vectors=VECTOR_INDEX_SUB_VECTORS
+        )
+    except Exception as e:
+        # Search still works without the index, only slower
+        logger.warning(f"⚠️ Could not build vector index: {str(e)}")
+
+
 def get_all_reference_data(db_path=DB_PATH):
     """
-    Retrieve all data from the reference table without filtering by relevance
+    Retrieve all data from the reference table without filtering by relevance.
+    Results are cached per db_path for REFERENCE_CACHE_TTL_SECONDS.
     """
+    cached = _reference_data_cache.get(db_path)
+    if cached and time.monotonic() - cached[0] < REFERENCE_CACHE_TTL_SECONDS:
+        logger.info(f"💾 Using {len(cached[1])} cached reference records")
+        return list(cached[1])
+
     try:
         logger.info("📚 Retrieving all reference data...")
-        db = lancedb.connect(db_path)
+        db = get_db(db_path)
 
         if REFERENCE_TABLE_NAME not in db.table_names():
             logger.warning("⚠️ Reference table does not exist!")
             return []
 
         ref_table = db.open_table(REFERENCE_TABLE_NAME)
-        all_data = ref_table.to_pandas()
-
-        logger.info(f"✅ Retrieved {len(all_data)} reference records")
-        return all_data["text"].tolist()
+        # Only the text column is read; the vectors are never needed here
+        reference_texts = (ref_table.search()
+                           .select(["text"])
+                           .limit(ref_table.count_rows())
+                           .to_arrow()
+                           .column("text")
+                           .to_pylist())
+
+        logger.info(f"✅ Retrieved {len(reference_texts)} reference records")
+        _reference_data_cache[db_path] = (time.monotonic(), tuple(reference_texts))
+        return reference_texts
 
     except Exception as e:
         logger.error(f"❌ Error retrieving all reference data: {str(e)}")
         raise
 
 
-def get_relevant_chunk(query, db, table_name, document_name):
+def get_reference_text(db_path=DB_PATH):
+    """
+    All reference data joined with newlines, as it is embedded in prompts.
+    Cached like get_all_reference_data so the join isn't redone per document.
+    """
+    cached = _reference_text_cache.get(db_path)
+    if cached and time.monotonic() - cached[0] < REFERENCE_CACHE_TTL_SECONDS:
+        return cached[1]
+
+    reference_text = "\n".join(get_all_reference_data(db_path))
+    if reference_text:
+        _reference_text_cache[db_path] = (time.monotonic(), reference_text)
+    return reference_text
+
+
+def _schedule_compaction(table):
+    """Compact the temp table in the background once enough deletes have piled up"""
+    global _temp_deletes_since_compaction
+    with _temp_deletes_lock:
+        _temp_deletes_since_compaction += 1
+        if _temp_deletes_since_compaction < TEMP_COMPACT_EVERY_DELETES:
+            return
+        _temp_deletes_since_compaction = 0
+    _compaction_pool.submit(_compact_table, table)
+
+
+def _compact_table(table):
     try:
-        logger.info("🔍 Searching for relevant fragment...")
-        query_embedding = get_embedding(query)
-        table = db.open_table(table_name)
-        result = table.search(query_embedding).where(
-            f'document_name == "{document_name}"').to_pandas()
+        # Rewrites small fragments, drops deleted rows and folds new rows into the indexes
+        with _temp_table_lock:
+            table.optimize()
+        logger.info(f"🧹 Compacted LanceDB table {table.name}")
+    except Exception as e:
+        logger.warning(f"⚠️ Could not compact LanceDB table: {str(e)}")
+
 
-        table.delete(f'document_name == "{document_name}"')
+def _document_filter(document_name):
+    """
+    LanceDB predicate for one document. LanceDB filters take no bound
+    parameters, so the name is validated and quoted as a SQL string literal.
+    """
+    if not _DOCUMENT_NAME_RE.match(document_name):
+        raise ValueError(f"Invalid document name: {document_name!r}")
+    return f"document_name = '{document_name}'"
 
-        return result["text"].tolist()
+
+def get_relevant_chunk(query, db, table_name, document_name, top_k=10):
+    try:
+        logger.info("🔍 Searching for relevant fragment...")
+        document_filter = _document_filter(document_name)
+        query_embedding = _unit_vectors(get_embedding_cached(query))[0]
+        table = db.open_table(table_name)
+        result = (table.search(query_embedding)
+                  .distance_type("dot")
+                  .where(document_filter, prefilter=True)
+                  .nprobes(VECTOR_SEARCH_NPROBES)
+                  .refine_factor(VECTOR_SEARCH_REFINE_FACTOR)
+                  .select(["text"])
+                  .limit(top_k)
+                  .to_list())
+
+        with _temp_table_lock:
+            table.delete(document_filter)
+        _schedule_compaction(table)
+
+        return [row["text"] for row in result]
 
     except Exception as e:
         logger.error(f"❌ Error retrieving relevant chunk: {str(e)}")
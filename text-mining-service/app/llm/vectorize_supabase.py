@@ -1,15 +1,25 @@
 import os
-import re
-import json
+import orjson
+import time
 import boto3
-import psycopg2
-import unicodedata
+import hashlib
+import threading
+from botocore.config import Config
+import numpy as np
+from io import StringIO
 from pathlib import Path
 from datetime import datetime
+from functools import lru_cache
+from contextlib import contextmanager
 from dotenv import load_dotenv
 from psycopg2.extras import execute_values
-from app.utils.config.config_util import AWS
+from psycopg2.pool import ThreadedConnectionPool
+from pgvector.psycopg2 import register_vector
+from concurrent.futures import ThreadPoolExecutor
+from app.utils.config.config_util import (AWS, EMBEDDING_MAX_CONCURRENCY, EMBEDDING_DIMENSIONS, BEDROCK_REGION,
+                                          BEDROCK_ENDPOINT_URL)
 from app.utils.logger.logger_util import get_logger
+from app.utils.strings.string_util import normalize_filename
 
 load_dotenv()
 logger = get_logger()
@@ -20,71 +30,202 @@ HOST = os.getenv("SUPABASE_HOST")
 PORT = os.getenv("SUPABASE_PORT")
 DBNAME = os.getenv("SUPABASE_DB")
 
+REFERENCE_CACHE_TTL_SECONDS = 60 * 60
+TEMP_EMBEDDINGS_MAX_AGE_MINUTES = 60
+TEMP_CLEANUP_INTERVAL_SECONDS = 10 * 60
+EMBEDDING_MODEL_ID = "amazon.titan-embed-text-v2:0"
+EMBEDDING_CACHE_SIZE = 8192
+POOL_MIN_CONNECTIONS = 2
+POOL_MAX_CONNECTIONS = 20
+POOL_ACQUIRE_TIMEOUT_SECONDS = 30
 
+_last_temp_cleanup = 0.0
+
+# Created on first use so importing the module doesn't require a reachable database
+_connection_pool = None
+_connection_pool_lock = threading.Lock()
+# getconn raises PoolError once every connection is out; callers wait for a free one instead
+_connection_slots = threading.BoundedSemaphore(POOL_MAX_CONNECTIONS)
+
+# (loaded_at, reference texts); the CLARISA reference rows don't change within a deploy
+_reference_data_cache = None
+
+
+# Shared by the embedding worker threads; adaptive retries absorb Titan throttling
 bedrock_runtime = boto3.client(
     service_name='bedrock-runtime',
     aws_access_key_id=AWS['aws_access_key'],
     aws_secret_access_key=AWS['aws_secret_key'],
-    region_name='us-east-1' 
+    region_name=BEDROCK_REGION,
+    endpoint_url=BEDROCK_ENDPOINT_URL,
+    config=Config(
+        max_pool_connections=50,
+        retries={"max_attempts": 5, "mode": "adaptive"},
+        tcp_keepalive=True,
+        connect_timeout=3,
+        read_timeout=60
+    )
 )
 
 
-def get_connection():
-    return psycopg2.connect(
-        dbname=DBNAME,
-        user=USER,
-        password=PASSWORD,
-        host=HOST,
-        port=PORT
-    )
+def _get_connection_pool():
+    global _connection_pool
+    if _connection_pool is None:
+        with _connection_pool_lock:
+            if _connection_pool is None:
+                pool = ThreadedConnectionPool(
+                    POOL_MIN_CONNECTIONS,
+                    POOL_MAX_CONNECTIONS,
+                    dbname=DBNAME,
+                    user=USER,
+                    password=PASSWORD,
+                    host=HOST,
+                    port=PORT
+                )
+                # Registers the vector/halfvec type casters for every connection at once
+                conn = pool.getconn()
+                try:
+                    register_vector(conn, globally=True)
+                finally:
+                    pool.putconn(conn)
+                _connection_pool = pool
+    return _connection_pool
+
+
+@contextmanager
+def pooled_connection():
+    """
+    Borrow a connection from the shared pool instead of opening (and
+    authenticating) a new one per query. Uncommitted work is rolled back
+    when the connection is returned.
+
+    Waits up to POOL_ACQUIRE_TIMEOUT_SECONDS when every connection is in use.
+    """
+    pool = _get_connection_pool()
+    if not _connection_slots.acquire(timeout=POOL_ACQUIRE_TIMEOUT_SECONDS):
+        raise TimeoutError(f"No database connection free after {POOL_ACQUIRE_TIMEOUT_SECONDS}s")
+    try:
+        conn = pool.getconn()
+        try:
+            yield conn
+        finally:
+            pool.putconn(conn, close=bool(conn.closed))
+    finally:
+        _connection_slots.release()
 
 
 def initialize_supabase_tables():
     try:
         logger.info("🛠️ Checking or creating `reference_embeddings` and `temp_embeddings` tables...")
-        conn = get_connection()
-        cur = conn.cursor()
-
-        cur.execute("""
-            CREATE TABLE IF NOT EXISTS reference_embeddings (
-                id UUID DEFAULT uuid_generate_v4() PRIMARY KEY,
-                text TEXT,
-                vector VECTOR(1024),
-                is_reference BOOLEAN,
-                document_name TEXT
-            );
-
-            CREATE TABLE IF NOT EXISTS temp_embeddings (
-                id UUID DEFAULT uuid_generate_v4() PRIMARY KEY,
-                text TEXT,
-                vector VECTOR(1024),
-                is_reference BOOLEAN,
-                document_name TEXT
-            );
-        """)
-
-        conn.commit()
-        cur.close()
-        conn.close()
+        with pooled_connection() as conn:
+            cur = conn.cursor()
+
+            # Half-precision vectors: half the storage and faster distance scans,
+            # with no practical effect on chunk ranking
+            cur.execute(f"""
+                CREATE TABLE IF NOT EXISTS reference_embeddings (
+                    id UUID DEFAULT uuid_generate_v4() PRIMARY KEY,
+                    text TEXT,
+                    vector HALFVEC({EMBEDDING_DIMENSIONS}),
+                    is_reference BOOLEAN,
+                    document_name TEXT
+                );
+
+                CREATE TABLE IF NOT EXISTS temp_embeddings (
+                    id UUID DEFAULT uuid_generate_v4() PRIMARY KEY,
+                    text TEXT,
+                    vector HALFVEC({EMBEDDING_DIMENSIONS}),
+                    is_reference BOOLEAN,
+                    document_name TEXT,
+                    inserted_at TIMESTAMPTZ NOT NULL DEFAULT now()
+                );
+
+                -- Every request shares this table; rows are scoped by document_name
+                CREATE INDEX IF NOT EXISTS temp_embeddings_document_name_idx
+                    ON temp_embeddings (document_name);
+
+                -- Titan vectors (float32 bytes) by content digest, shared by every instance
+                CREATE TABLE IF NOT EXISTS embedding_cache (
+                    digest TEXT PRIMARY KEY,
+                    vector BYTEA NOT NULL
+                );
+            """)
+            _migrate_vector_columns(cur)
+
+            # Searches are exact over one document's rows (see get_relevant_chunk), so
+            # an ANN index would only slow down every insert
+            cur.execute("DROP INDEX IF EXISTS temp_embeddings_hnsw")
+
+            conn.commit()
+            cur.close()
         logger.info("✅ Supabase tables ready!")
 
+        delete_stale_temp_embeddings()
+
     except Exception as e:
         logger.error(f"❌ Error creating tables: {str(e)}")
         raise
 
 
+def _migrate_vector_columns(cur):
+    """
+    Bring vector columns of older tables to halfvec(EMBEDDING_DIMENSIONS) (no-op afterwards).
+    Vectors of another size can't be converted, so those rows are deleted; reference
+    rows are then re-embedded by the next initialize_reference_data.
+    """
+    target = f"halfvec({EMBEDDING_DIMENSIONS})"
+    for table in ("reference_embeddings", "temp_embeddings"):
+        cur.execute("""
+            SELECT format_type(atttypid, atttypmod)
+            FROM pg_attribute
+            WHERE attrelid = %s::regclass AND attname = 'vector'
+        """, (table,))
+        row = cur.fetchone()
+        if row and row[0] != target:
+            logger.info(f"🛠️ Converting {table}.vector from {row[0]} to {target}...")
+            if not row[0].endswith(f"({EMBEDDING_DIMENSIONS})"):
+                cur.execute(f"DELETE FROM {table}")
+            cur.execute(f"ALTER TABLE {table} ALTER COLUMN vector TYPE {target} USING vector::{target}")
+
+
+def delete_stale_temp_embeddings(max_age_minutes=TEMP_EMBEDDINGS_MAX_AGE_MINUTES):
+    """
+    Remove temp rows left behind by requests that never reached retrieval.
+    Runs at most once per TEMP_CLEANUP_INTERVAL_SECONDS per process.
+    """
+    global _last_temp_cleanup
+    if time.monotonic() - _last_temp_cleanup < TEMP_CLEANUP_INTERVAL_SECONDS:
+        return
+    _last_temp_cleanup = time.monotonic()
+
+    try:
+        with pooled_connection() as conn:
+            cur = conn.cursor()
+            cur.execute(
+                "DELETE FROM temp_embeddings WHERE inserted_at < now() - make_interval(mins => %s)",
+                (max_age_minutes,)
+            )
+            if cur.rowcount:
+                logger.info(f"🧹 Deleted {cur.rowcount} stale temporary embeddings")
+            conn.commit()
+            cur.close()
+    except Exception as e:
+        logger.warning(f"⚠️ Error deleting stale temporary embeddings: {str(e)}")
+
+
 def get_embedding(text):
     try:
         request_body = {
-            "inputText": text
+            "inputText": text,
+            "dimensions": EMBEDDING_DIMENSIONS
         }
         response = bedrock_runtime.invoke_model(
-            modelId="amazon.titan-embed-text-v2:0",
-            body=json.dumps(request_body),
+            modelId=EMBEDDING_MODEL_ID,
+            body=orjson.dumps(request_body),
             contentType="application/json",
             accept="application/json"
         )
-        response_body = json.loads(response['body'].read())
+        response_body = orjson.loads(response['body'].read())
         embeddings = response_body['embedding']
         
         return embeddings
@@ -93,23 +234,119 @@ def get_embedding(text):
         raise
 
 
+@lru_cache(maxsize=EMBEDDING_CACHE_SIZE)
+def _cached_embedding(text):
+    return tuple(get_embedding(text))
+
+
+def get_embedding_cached(text):
+    """
+    get_embedding backed by an in-process LRU: the prompt and the reference
+    documents are embedded again on every request otherwise. Failures are not cached.
+    """
+    if not isinstance(text, str):
+        return get_embedding(text)
+    return list(_cached_embedding(text))
+
+
+def _embedding_digest(text):
+    """Cache key for a text, or None if the text is not cacheable"""
+    if not isinstance(text, str) or not text.strip():
+        return None
+    return hashlib.blake2b(f"{EMBEDDING_MODEL_ID}:{EMBEDDING_DIMENSIONS}\0{text}".encode("utf-8"), digest_size=16).hexdigest()
+
+
+def _load_stored_embeddings(digests):
+    """Vectors already in embedding_cache for these digests; empty if the lookup fails"""
+    if not digests:
+        return {}
+    try:
+        with pooled_connection() as conn:
+            cur = conn.cursor()
+            cur.execute("SELECT digest, vector FROM embedding_cache WHERE digest = ANY(%s)", (digests,))
+            found = {digest: np.frombuffer(blob, dtype=np.float32).tolist() for digest, blob in cur.fetchall()}
+            cur.close()
+        return found
+    except Exception as e:
+        logger.warning(f"⚠️ Error reading the embedding cache: {str(e)}")
+        return {}
+
+
+def _store_embeddings(vectors_by_digest):
+    """Persist new vectors in one statement; a failure only costs re-embedding later"""
+    if not vectors_by_digest:
+        return
+    try:
+        with pooled_connection() as conn:
+            cur = conn.cursor()
+            execute_values(cur, """
+                INSERT INTO embedding_cache (digest, vector) VALUES %s
+                ON CONFLICT (digest) DO NOTHING
+            """, [(digest, np.asarray(vector, dtype=np.float32).tobytes())
+                  for digest, vector in vectors_by_digest.items()], page_size=1000)
+            conn.commit()
+            cur.close()
+    except Exception as e:
+        logger.warning(f"⚠️ Error writing the embedding cache: {str(e)}")
+
+
+def get_embeddings_batch(texts, max_workers=EMBEDDING_MAX_CONCURRENCY):
+    """
+    Embed several texts concurrently, returned in the same order as the input.
+
+    Titan v2 takes a single inputText per request, so a batch can't share one
+    call; instead identical texts are sent only once, texts already in
+    embedding_cache are not sent at all, and the rest are embedded in parallel.
+    """
+    texts = list(texts)
+    positions = {}
+    for i, text in enumerate(texts):
+        positions.setdefault(text if isinstance(text, str) else i, []).append(i)
+
+    keys = list(positions)
+    distinct = [texts[positions[key][0]] for key in keys]
+
+    digests = [_embedding_digest(text) for text in distinct]
+    stored = _load_stored_embeddings([digest for digest in digests if digest])
+    embedded = [stored.get(digest) for digest in digests]
+    missing = [i for i, digest in enumerate(digests) if digest not in stored]
+    to_embed = [distinct[i] for i in missing]
+
+    if len(to_embed) <= 1:
+        new_embeddings = [get_embedding_cached(text) for text in to_embed]
+    else:
+        workers = min(max_workers, len(to_embed))
+        logger.info(f"#️⃣ Generating {len(to_embed)} embeddings with {workers} workers ({len(texts) - len(to_embed)} stored or repeated)...")
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            new_embeddings = list(executor.map(get_embedding_cached, to_embed))
+
+    for i, embedding in zip(missing, new_embeddings):
+        embedded[i] = embedding
+    _store_embeddings({digests[i]: embedded[i] for i in missing if digests[i]})
+
+    vectors = [None] * len(texts)
+    for key, embedding in zip(keys, embedded):
+        for i in positions[key]:
+            vectors[i] = embedding
+    return vectors
+
+
+def clear_reference_data_cache():
+    """Forget the cached reference texts so the next call re-reads the table"""
+    global _reference_data_cache
+    _reference_data_cache = None
+
+
 def store_reference_embeddings(chunks, embeddings):
-    """Check if reference table already exists in the database"""
+    """Store reference chunks and their embeddings (parallel lists) in one COPY"""
+    clear_reference_data_cache()
     try:
         logger.info("💾 Storing reference embeddings in Supabase (PostgreSQL)...")
-        conn = get_connection()
-        cur = conn.cursor()
-
-        data = [
-            (chunks, embeddings, True, None)
-        ]
-        execute_values(cur, """
-            INSERT INTO reference_embeddings (text, vector, is_reference, document_name)
-            VALUES %s
-        """, data)
-        conn.commit()
-        cur.close()
-        conn.close()
+        with pooled_connection() as conn:
+            cur = conn.cursor()
+            _copy_embeddings(cur, "reference_embeddings", chunks, embeddings, is_reference=True)
+            conn.commit()
+            cur.close()
     except Exception as e:
         logger.error(f"❌ Error storing reference embeddings: {str(e)}")
         raise
@@ -123,21 +360,13 @@ def store_temp_embeddings(chunks, embeddings, file_key):
         document_name = f"{s_file_key}_{timestamp}"
 
         logger.info("💾 Storing temporary document embeddings in Supabase (PostgreSQL)...")
-        conn = get_connection()
-        cur = conn.cursor()
+        with pooled_connection() as conn:
+            cur = conn.cursor()
 
-        data = [
-            (chunk, embedding, False, document_name)
-            for chunk, embedding in zip(chunks, embeddings)
-        ]
-        
-        execute_values(cur, """
-            INSERT INTO temp_embeddings (text, vector, is_reference, document_name)
-            VALUES %s
-        """, data)
-        conn.commit()
-        cur.close()
-        conn.close()
+            _copy_embeddings(cur, "temp_embeddings", chunks, embeddings,
+                             is_reference=False, document_name=document_name)
+            conn.commit()
+            cur.close()
 
         return document_name
     except Exception as e:
@@ -145,19 +374,46 @@ def store_temp_embeddings(chunks, embeddings, file_key):
             raise
 
 
+def _copy_embeddings(cur, table, chunks, embeddings, is_reference, document_name=None):
+    """One COPY round-trip for all rows instead of paged multi-row INSERTs"""
+    reference_flag = "t" if is_reference else "f"
+    escaped_name = _copy_escape(document_name) if document_name is not None else "\\N"
+    buffer = StringIO("".join(
+        f"{_copy_escape(chunk)}\t[{','.join(map(str, embedding))}]\t{reference_flag}\t{escaped_name}\n"
+        for chunk, embedding in zip(chunks, embeddings)
+    ))
+    cur.copy_expert(
+        f"COPY {table} (text, vector, is_reference, document_name) FROM STDIN",
+        buffer
+    )
+
+
+def _copy_escape(value):
+    """Escape a value for COPY ... FROM STDIN text format"""
+    return (value.replace("\\", "\\\\").replace("\t", "\\t")
+            .replace("\n", "\\n").replace("\r", "\\r"))
+
+
 def get_all_reference_data():
+    """All reference texts, cached in process for REFERENCE_CACHE_TTL_SECONDS"""
+    global _reference_data_cache
+    if _reference_data_cache and time.monotonic() - _reference_data_cache[0] < REFERENCE_CACHE_TTL_SECONDS:
+        logger.info(f"💾 Using {len(_reference_data_cache[1])} cached reference records")
+        return list(_reference_data_cache[1])
+
     try:
         logger.info("📚 Retrieving all reference data from Supabase...")
-        conn = get_connection()
-        cur = conn.cursor()
+        with pooled_connection() as conn:
+            cur = conn.cursor()
 
-        cur.execute("SELECT text FROM reference_embeddings WHERE is_reference = TRUE")
-        results = [row[0] for row in cur.fetchall()]
+            cur.execute("SELECT text FROM reference_embeddings WHERE is_reference = TRUE")
+            results = [row[0] for row in cur.fetchall()]
 
-        cur.close()
-        conn.close()
+            cur.close()
 
         logger.info(f"✅ Retrieved {len(results)} reference records")
+        if results:
+            _reference_data_cache = (time.monotonic(), tuple(results))
         return results
 
     except Exception as e:
@@ -165,37 +421,35 @@ def get_all_reference_data():
         raise
 
 
-def normalize_filename(filename):
-    filename = unicodedata.normalize('NFKD', filename)
-    filename = filename.encode('ASCII', 'ignore').decode('utf-8')
-    filename = filename.lower().replace(" ", "_")
-    filename = re.sub(r'[^a-z0-9_\-\.]', '', filename)
-    
-    return filename
-
-
 def get_relevant_chunk(query, document_name, top_k=50):
     try:
         logger.info("🔍 Searching for relevant fragment in Supabase...")
-        query_embedding = get_embedding(query)
-        conn = get_connection()
-        cur = conn.cursor()
-
-        cur.execute("""
-            SELECT text
-            FROM temp_embeddings
-            WHERE is_reference = FALSE AND document_name = %s
-            ORDER BY vector <-> %s
-            LIMIT %s
-        """, (document_name, f"[{', '.join(map(str, query_embedding))}]", top_k))
-
-        results = [row[0] for row in cur.fetchall()]
-
-        cur.execute("DROP TABLE IF EXISTS temp_embeddings")
-        conn.commit()
-
-        cur.close()
-        conn.close()
+        query_embedding = np.asarray(get_embedding_cached(query), dtype=np.float32)
+        with pooled_connection() as conn:
+            cur = conn.cursor()
+
+            # Pre-filter on the document_name B-tree, then exact kNN over that
+            # document's few hundred rows: full recall, and concurrent documents in
+            # the shared table can't crowd this one out of an ANN candidate list
+            cur.execute("""
+                WITH document_chunks AS MATERIALIZED (
+                    SELECT text, vector
+                    FROM temp_embeddings
+                    WHERE is_reference = FALSE AND document_name = %s
+                )
+                SELECT text
+                FROM document_chunks
+                ORDER BY vector <-> %s::halfvec
+                LIMIT %s
+            """, (document_name, query_embedding, top_k))
+
+            results = [row[0] for row in cur.fetchall()]
+
+            # Only this document's rows: the table and its indexes are shared by concurrent requests
+            cur.execute("DELETE FROM temp_embeddings WHERE document_name = %s", (document_name,))
+            conn.commit()
+
+            cur.close()
 
         return results
 
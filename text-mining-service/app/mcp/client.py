@@ -1,10 +1,13 @@
 import os
 import json
 import base64
+import anyio
+import asyncio
 import boto3
 import uvicorn
 from io import BytesIO
 from typing import Optional, Union
+from contextlib import asynccontextmanager
 from pydantic import BaseModel, Field
 from mcp.client.stdio import stdio_client
 from fastapi.responses import FileResponse, StreamingResponse
@@ -74,7 +77,78 @@ class BulkUploadRecord(BaseModel):
     lastUpdated: str = Field(..., description="Timestamp of last update")
 
 
+# Shared MCP session: the server subprocess is spawned and initialized once and
+# reused by every request, instead of once per request
+_mcp_session = None
+_mcp_session_task = None
+_mcp_session_stop = None
+_mcp_session_lock = asyncio.Lock()
+
+
+async def _serve_mcp_session(ready, stop):
+    """Owns the server subprocess and session, so both are opened and closed in this one task"""
+    try:
+        async with stdio_client(server_params) as (read, write):
+            async with ClientSession(read, write, sampling_callback=handle_sampling_message) as session:
+                await session.initialize()
+                ready.set_result(session)
+                await stop.wait()
+    except Exception as e:
+        if not ready.done():
+            ready.set_exception(e)
+        else:
+            logger.error(f"❌ MCP session closed unexpectedly: {str(e)}")
+
+
+async def get_mcp_session():
+    """The shared session, (re)starting the MCP server if it isn't running"""
+    global _mcp_session, _mcp_session_task, _mcp_session_stop
+    async with _mcp_session_lock:
+        if _mcp_session is None or _mcp_session_task.done():
+            logger.info("🔌 Starting MCP server session...")
+            ready = asyncio.get_running_loop().create_future()
+            _mcp_session_stop = asyncio.Event()
+            _mcp_session_task = asyncio.create_task(_serve_mcp_session(ready, _mcp_session_stop))
+            try:
+                _mcp_session = await ready
+            except Exception:
+                _mcp_session = None
+                raise
+        return _mcp_session
+
+
+async def call_mcp_tool(name, arguments):
+    session = await get_mcp_session()
+    try:
+        return await session.call_tool(name, arguments=arguments)
+    except (anyio.ClosedResourceError, anyio.BrokenResourceError):
+        # The server process went away; the next call starts a new one
+        logger.warning("⚠️ MCP server connection lost, it will be restarted")
+        await close_mcp_session()
+        raise
+
+
+async def close_mcp_session():
+    global _mcp_session
+    if _mcp_session_task is not None and not _mcp_session_task.done():
+        _mcp_session_stop.set()
+        await _mcp_session_task
+    _mcp_session = None
+
+
+@asynccontextmanager
+async def lifespan(app):
+    try:
+        await get_mcp_session()
+    except Exception as e:
+        # Retried on the first request that needs it
+        logger.warning(f"Could not start MCP session: {str(e)}")
+    yield
+    await close_mcp_session()
+
+
 app = FastAPI(
+    lifespan=lifespan,
     title="CGIAR Text Mining Service API",
     description="""
     AI-Powered Document Processing Service:
@@ -532,15 +606,13 @@ async def process_document_endpoint(
 
     if file is not None:
         try:
-            file_content = await file.read()
-
             filename = file.filename
             key = f"{STAR_BUCKET_KEY_NAME}/{filename}"
 
             content_type = file.content_type
 
             upload_file_to_s3(
-                file_content=file_content,
+                file_content=file.file,
                 bucket_name=bucketName,
                 file_key=key,
                 content_type=content_type
@@ -557,25 +629,21 @@ async def process_document_endpoint(
         f"Processing document with key: {key} from bucket {bucketName}")
 
     try:
-        async with stdio_client(server_params) as (read, write):
-            async with ClientSession(read, write, sampling_callback=handle_sampling_message) as session:
-                await session.initialize()
+        mcp_arguments = {
+            "bucket": bucketName,
+            "key": key,
+            "token": token,
+            "environmentUrl": environmentUrl
+        }
+        
+        if user_id:
+            mcp_arguments["user_id"] = user_id
 
-                mcp_arguments = {
-                    "bucket": bucketName,
-                    "key": key,
-                    "token": token,
-                    "environmentUrl": environmentUrl
-                }
-                
-                if user_id:
-                    mcp_arguments["user_id"] = user_id
-
-                result = await session.call_tool(
-                    "process_document",
-                    arguments=mcp_arguments
-                )
-                return result
+        result = await call_mcp_tool(
+            "process_document",
+            arguments=mcp_arguments
+        )
+        return result
 
     except Exception as e:
         logger.error(f"Error processing document: {str(e)}")
@@ -649,15 +717,13 @@ async def process_document_prms_endpoint(
     
     if file is not None:
         try:
-            file_content = await file.read()
-
             filename = file.filename
             key = f"{PRMS_BUCKET_KEY_NAME}/{filename}"
 
             content_type = file.content_type
 
             upload_file_to_s3(
-                file_content=file_content,
+                file_content=file.file,
                 bucket_name=bucketName,
                 file_key=key,
                 content_type=content_type
@@ -674,25 +740,21 @@ async def process_document_prms_endpoint(
         f"Processing document for PRMS with key: {key} from bucket {bucketName}")
 
     try:
-        async with stdio_client(server_params) as (read, write):
-            async with ClientSession(read, write, sampling_callback=handle_sampling_message) as session:
-                await session.initialize()
-
-                mcp_arguments = {
-                    "bucket": bucketName,
-                    "key": key,
-                    "token": token,
-                    "environmentUrl": environmentUrl
-                }
+        mcp_arguments = {
+            "bucket": bucketName,
+            "key": key,
+            "token": token,
+            "environmentUrl": environmentUrl
+        }
 
-                if user_id:
-                    mcp_arguments["user_id"] = user_id
+        if user_id:
+            mcp_arguments["user_id"] = user_id
 
-                result = await session.call_tool(
-                    "process_document_prms",
-                    arguments=mcp_arguments
-                )
-                return result
+        result = await call_mcp_tool(
+            "process_document_prms",
+            arguments=mcp_arguments
+        )
+        return result
 
     except Exception as e:
         logger.error(f"Error processing document for PRMS: {str(e)}")
@@ -751,15 +813,13 @@ async def bulk_upload_capdev_endpoint(
 
     if file is not None:
         try:
-            file_content = await file.read()
-
             filename = file.filename
             key = f"{STAR_BUCKET_KEY_NAME}/bulk_upload/{filename}"
 
             content_type = file.content_type
 
             upload_file_to_s3(
-                file_content=file_content,
+                file_content=file.file,
                 bucket_name=bucketName,
                 file_key=key,
                 content_type=content_type
@@ -776,20 +836,16 @@ async def bulk_upload_capdev_endpoint(
         f"Processing document with key: {key} from bucket {bucketName}")
 
     try:
-        async with stdio_client(server_params) as (read, write):
-            async with ClientSession(read, write, sampling_callback=handle_sampling_message) as session:
-                await session.initialize()
-
-                result = await session.call_tool(
-                    "process_document_capdev",
-                    arguments={
-                        "bucket": bucketName,
-                        "key": key,
-                        "token": token,
-                        "environmentUrl": environmentUrl
-                    }
-                )
-                return result
+        result = await call_mcp_tool(
+            "process_document_capdev",
+            arguments={
+                "bucket": bucketName,
+                "key": key,
+                "token": token,
+                "environmentUrl": environmentUrl
+            }
+        )
+        return result
 
     except Exception as e:
         logger.error(f"Error processing document: {str(e)}")
@@ -873,15 +929,13 @@ async def process_document_aiccra_endpoint(
 
     if file is not None:
         try:
-            file_content = await file.read()
-
             filename = file.filename
             key = f"{AICCRA_BUCKET_KEY_NAME}/{filename}"
 
             content_type = file.content_type
 
             upload_file_to_s3(
-                file_content=file_content,
+                file_content=file.file,
                 bucket_name=bucketName,
                 file_key=key,
                 content_type=content_type
@@ -898,28 +952,24 @@ async def process_document_aiccra_endpoint(
         f"Processing document with key: {key} from bucket {bucketName}")
 
     try:
-        async with stdio_client(server_params) as (read, write):
-            async with ClientSession(read, write, sampling_callback=handle_sampling_message) as session:
-                await session.initialize()
+        mcp_arguments = {
+            "bucket": bucketName,
+            "key": key,
+            "token": token,
+            "environmentUrl": environmentUrl
+        }
+        
+        if user_id:
+            mcp_arguments["user_id"] = user_id
+        
+        if prompt:
+            mcp_arguments["prompt"] = prompt
 
-                mcp_arguments = {
-                    "bucket": bucketName,
-                    "key": key,
-                    "token": token,
-                    "environmentUrl": environmentUrl
-                }
-                
-                if user_id:
-                    mcp_arguments["user_id"] = user_id
-                
-                if prompt:
-                    mcp_arguments["prompt"] = prompt
-
-                result = await session.call_tool(
-                    "process_document_aiccra",
-                    arguments=mcp_arguments
-                )
-                return result
+        result = await call_mcp_tool(
+            "process_document_aiccra",
+            arguments=mcp_arguments
+        )
+        return result
 
     except Exception as e:
         logger.error(f"Error processing document: {str(e)}")
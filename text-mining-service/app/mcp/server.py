@@ -1,5 +1,6 @@
 import sys
 import boto3
+import asyncio
 import logging
 from typing import Any
 from dotenv import load_dotenv
@@ -10,6 +11,7 @@ from app.middleware.prms_auth_middleware import AuthMiddleware as PrmsAuthMiddle
 from app.llm.mining import process_document as process_with_llm
 from app.llm.mining import process_document_prms as process_with_llm_prms
 from app.utils.notification.notification_service import NotificationService
+from app.utils.interactions.interaction_client import interaction_client
 from app.llm.bulk_upload.upload_capdev import process_document_capdev as process_bulk_capdev
 from app.llm.aiccra_mining.aiccra_mining import process_document_aiccra as process_with_llm_aiccra
 
@@ -24,6 +26,8 @@ star_auth_middleware = StarAuthMiddleware()
 prms_auth_middleware = PrmsAuthMiddleware()
 notification_service = NotificationService()
 
+# One server process serves every request of the API; the blocking pipelines run
+# in worker threads so concurrent tool calls don't queue behind each other
 mcp = FastMCP("DocumentProcessor")
 
 s3_client = boto3.client("s3")
@@ -58,6 +62,27 @@ async def authenticate_prms(key: str, bucket: str, token: str, environmentUrl: s
         return None
 
 
+async def track_interaction(result):
+    """
+    Send the interaction prepared by the pipeline; awaited so it is written
+    before the tool returns. The interaction_id is dropped from the result
+    when the write fails, so callers never get an ID that doesn't exist.
+    """
+    interaction = result.pop("interaction", None)
+    if not interaction:
+        return False
+    try:
+        tracked = await asyncio.to_thread(interaction_client.track_interaction, **interaction)
+    except Exception as e:
+        logger.error(f"❌ Error tracking interaction: {str(e)}")
+        tracked = None
+    if not tracked:
+        logger.warning("⚠️ Failed to track interaction with interaction service")
+        result.pop("interaction_id", None)
+        return False
+    return True
+
+
 @mcp.tool()
 async def process_document(bucket: str, key: str, token: Any, environmentUrl: str, user_id: str = None) -> dict:
     logger.info("✅ process_document invoked via MCP")
@@ -71,17 +96,21 @@ async def process_document(bucket: str, key: str, token: Any, environmentUrl: st
         logger.info(f"Processing document: {key} from bucket: {bucket}")
         logger.info(f"👤 User ID for tracking: {user_id}")
 
-        result = process_with_llm(
-            bucket_name=bucket, file_key=key, user_id=user_id)
-
-        await notification_service.send_slack_notification(
-            emoji=":ai: :pick:",
-            app_name="AI-MCP Mining Service (STAR)",
-            color="#36a64f",
-            title="Document Processed",
-            message=f"Successfully processed document: *{key}*\nBucket: *{bucket}*",
-            time_taken=f"Time taken: *{result['time_taken']}* seconds",
-            priority="Low"
+        result = await asyncio.to_thread(
+            process_with_llm, bucket_name=bucket, file_key=key, user_id=user_id)
+
+        # Tracked alongside the notification, so it is written before the response goes out
+        await asyncio.gather(
+            track_interaction(result),
+            notification_service.send_slack_notification(
+                emoji=":ai: :pick:",
+                app_name="AI-MCP Mining Service (STAR)",
+                color="#36a64f",
+                title="Document Processed",
+                message=f"Successfully processed document: *{key}*\nBucket: *{bucket}*",
+                time_taken=f"Time taken: *{result['time_taken']}* seconds",
+                priority="Low"
+            )
         )
 
         if "interaction_id" in result:
@@ -121,17 +150,21 @@ async def process_document_prms(bucket: str, key: str, token: Any, environmentUr
         logger.info(f"Processing document for PRMS: {key} from bucket: {bucket}")
         logger.info(f"👤 User ID for tracking: {user_id}")
 
-        result = process_with_llm_prms(
-            bucket_name=bucket, file_key=key, user_id=user_id)
-
-        await notification_service.send_slack_notification(
-            emoji=":ai: :pick:",
-            app_name="AI-MCP Mining Service (PRMS)",
-            color="#36a64f",
-            title="PRMS Document Processed",
-            message=f"Successfully processed document for PRMS: *{key}*\nBucket: *{bucket}*",
-            time_taken=f"Time taken: *{result['time_taken']}* seconds",
-            priority="Low"
+        result = await asyncio.to_thread(
+            process_with_llm_prms, bucket_name=bucket, file_key=key, user_id=user_id)
+
+        # Tracked alongside the notification, so it is written before the response goes out
+        await asyncio.gather(
+            track_interaction(result),
+            notification_service.send_slack_notification(
+                emoji=":ai: :pick:",
+                app_name="AI-MCP Mining Service (PRMS)",
+                color="#36a64f",
+                title="PRMS Document Processed",
+                message=f"Successfully processed document for PRMS: *{key}*\nBucket: *{bucket}*",
+                time_taken=f"Time taken: *{result['time_taken']}* seconds",
+                priority="Low"
+            )
         )
 
         if "interaction_id" in result:
@@ -170,7 +203,7 @@ async def process_document_capdev(bucket: str, key: str, token: Any, environment
 
         logger.info(f"Processing document: {key} from bucket: {bucket}")
 
-        result = process_bulk_capdev(
+        result = await process_bulk_capdev(
             bucket_name=bucket, file_key=key)
 
         await notification_service.send_slack_notification(
@@ -211,17 +244,21 @@ async def process_document_aiccra(bucket: str, key: str, token: Any, environment
         else:
             logger.info("📝 Using default AICCRA prompt")
 
-        result = process_with_llm_aiccra(
-            bucket_name=bucket, file_key=key, user_id=user_id, prompt=prompt)
-
-        await notification_service.send_slack_notification(
-            emoji=":ai: :pick:",
-            app_name="AI-MCP Mining Service (AICCRA)",
-            color="#36a64f",
-            title="Document Processed",
-            message=f"Successfully processed document: *{key}*\nBucket: *{bucket}*",
-            time_taken=f"Time taken: *{result['time_taken']}* seconds",
-            priority="Low"
+        result = await asyncio.to_thread(
+            process_with_llm_aiccra, bucket_name=bucket, file_key=key, user_id=user_id, prompt=prompt)
+
+        # Tracked alongside the notification, so it is written before the response goes out
+        await asyncio.gather(
+            track_interaction(result),
+            notification_service.send_slack_notification(
+                emoji=":ai: :pick:",
+                app_name="AI-MCP Mining Service (AICCRA)",
+                color="#36a64f",
+                title="Document Processed",
+                message=f"Successfully processed document: *{key}*\nBucket: *{bucket}*",
+                time_taken=f"Time taken: *{result['time_taken']}* seconds",
+                priority="Low"
+            )
         )
 
         if "interaction_id" in result:
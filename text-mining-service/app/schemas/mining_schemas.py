@@ -1,7 +1,7 @@
 import re
 from datetime import datetime
-from typing import List, Optional, Union, Literal
-from pydantic import BaseModel, Field, field_validator
+from typing import Annotated, List, Optional, Union, Literal
+from pydantic import BaseModel, Field, TypeAdapter, field_validator
 
 
 class GeoscopeModel(BaseModel):
@@ -217,6 +217,10 @@ class InnovationDevelopmentResult(BaseResultModel):
 
 ResultModel = Union[CapacityDevelopmentResult, PolicyChangeResult, InnovationDevelopmentResult]
 
+# Picks the model from "indicator" directly instead of trying each union member
+DiscriminatedResult = Annotated[ResultModel, Field(discriminator="indicator")]
+ResultListAdapter = TypeAdapter(List[DiscriminatedResult])
+
 class MiningResponse(BaseModel):
     """Complete mining response"""
     results: List[ResultModel] = Field(..., description="Extracted results from document")
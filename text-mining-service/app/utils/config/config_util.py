@@ -1,5 +1,6 @@
 import os
 from dotenv import load_dotenv
+from app.utils.logger.logger_util import get_logger
 
 load_dotenv()
 
@@ -17,5 +18,43 @@ AICCRA_BUCKET_KEY_NAME = os.getenv("AICCRA_BUCKET_KEY_NAME")
 
 MAPPING_URL = os.getenv("MAPPING_URL")
 
+# Bedrock is called in the region the service runs in (AWS_REGION is set by Lambda/ECS) unless
+# overridden; BEDROCK_ENDPOINT_URL points the clients at a bedrock-runtime VPC interface endpoint
+BEDROCK_REGION = os.getenv("BEDROCK_REGION") or AWS["aws_region"]
+BEDROCK_ENDPOINT_URL = os.getenv("BEDROCK_ENDPOINT_URL") or None
+
+# Cross-region inference profile prefix per region geography ("ap-southeast-2" -> "ap")
+BEDROCK_PROFILE_PREFIXES = {"us": "us", "eu": "eu", "ap": "apac"}
+BEDROCK_FALLBACK_REGION = "us-east-1"
+
+# Claude model or cross-region inference profile (defaults to Claude 3.7 Sonnet in
+# BEDROCK_REGION's geography), and Bedrock latency mode ("standard" or "optimized";
+# optimized is only available for some models and regions)
+BEDROCK_MODEL_ID = os.getenv("BEDROCK_MODEL_ID")
+if not BEDROCK_MODEL_ID:
+    _profile_prefix = BEDROCK_PROFILE_PREFIXES.get(BEDROCK_REGION.rsplit("-", 2)[0])
+    if _profile_prefix is None:
+        # No profile for this geography (e.g. us-gov, ca, sa): keep calling us-east-1
+        get_logger().warning(
+            f"⚠️ No Claude inference profile for {BEDROCK_REGION}, using {BEDROCK_FALLBACK_REGION}; "
+            "set BEDROCK_MODEL_ID to call Bedrock in this region")
+        BEDROCK_REGION, _profile_prefix = BEDROCK_FALLBACK_REGION, "us"
+    BEDROCK_MODEL_ID = f"{_profile_prefix}.anthropic.claude-3-7-sonnet-20250219-v1:0"
+BEDROCK_LATENCY_MODE = os.getenv("BEDROCK_LATENCY_MODE", "standard")
+
+# Character-based splitting of non-Excel documents (~4 characters per token)
+TEXT_CHUNK_SIZE = int(os.getenv("TEXT_CHUNK_SIZE", "8000"))
+TEXT_CHUNK_OVERLAP = int(os.getenv("TEXT_CHUNK_OVERLAP", "1500"))
+
+# Upper bound on retrieved document chunks sent to the model per request (estimated tokens)
+MAX_DOCUMENT_CONTEXT_TOKENS = int(os.getenv("MAX_DOCUMENT_CONTEXT_TOKENS", "60000"))
+
+# Concurrent Bedrock embedding requests per batch; keep within the account's Titan TPS quota
+EMBEDDING_MAX_CONCURRENCY = int(os.getenv("EMBEDDING_MAX_CONCURRENCY", "8"))
+
+# Titan v2 output size (256, 512 or 1024); 512 keeps nearly all retrieval quality at half
+# the storage and distance cost of 1024
+EMBEDDING_DIMENSIONS = int(os.getenv("EMBEDDING_DIMENSIONS", "512"))
+
 CLIENT_ID = os.getenv("CLIENT_ID", None)
 CLIENT_SECRET = os.getenv("CLIENT_SECRET", None)
\ No newline at end of file
@@ -23,7 +23,8 @@ class InteractionClient:
         service_description: Optional[str] = None,
         context: Optional[Dict[str, Any]] = None,
         response_time_seconds: Optional[float] = None,
-        platform: str = "STAR"
+        platform: str = "STAR",
+        interaction_id: Optional[str] = None
     ) -> Optional[Dict[str, Any]]:
         """
         Track an AI interaction with the feedback service.
@@ -36,6 +37,7 @@ class InteractionClient:
             context: Service-specific context data
             response_time_seconds: Time taken to process
             platform: Platform identifier
+            interaction_id: Pre-assigned interaction ID already returned to the caller (optional)
             
         Returns:
             Response from feedback service or None if failed
@@ -43,6 +45,7 @@ class InteractionClient:
         try:
             payload = {
                 "user_id": user_id,
+                "interaction_id": interaction_id,
                 "ai_output": ai_output,
                 "service_name": service_name,
                 "display_name": display_name,
@@ -2,7 +2,10 @@ import docx
 import boto3
 import pandas as pd
 from io import BytesIO
+from functools import lru_cache
+from typing import Iterable, Literal, NamedTuple, Optional
 from PyPDF2 import PdfReader
+from boto3.s3.transfer import TransferConfig
 from pptx import Presentation
 from app.utils.config.config_util import AWS
 from app.utils.logger.logger_util import get_logger
@@ -11,8 +14,48 @@ logger = get_logger()
 
 s3_client = boto3.client('s3')
 
+# Raw objects kept per (bucket, key, ETag); only the small CLARISA reference
+# files are cached, uploaded documents are always read straight through
+S3_OBJECT_CACHE_SIZE = 4
+
+# File-like uploads are sent in 8 MB multipart chunks, so memory stays bounded by
+# chunk size x concurrency rather than the size of the file
+UPLOAD_TRANSFER_CONFIG = TransferConfig(
+    multipart_threshold=8 * 1024 * 1024,
+    multipart_chunksize=8 * 1024 * 1024,
+    max_concurrency=8
+)
+
+
+class ParsedDoc(NamedTuple):
+    """A document read from S3, with its shape checked once up front"""
+    kind: Literal["excel", "text"]
+    chunks: Optional[Iterable[str]]  # Excel rows (a list, or a generator when streamed)
+    raw: Optional[str]  # Text content of non-Excel documents
+
+
+def normalize_document(document_content):
+    """Wrap the result of read_document_from_s3 in a ParsedDoc"""
+    if isinstance(document_content, dict) and document_content.get("type") == "excel":
+        return ParsedDoc("excel", document_content["chunks"], None)
+    return ParsedDoc("text", None, document_content)
+
+
+def iter_excel_rows(df):
+    """Yield each non-empty DataFrame row as a "column: value, ..." string"""
+    columns = list(df.columns)
+    for row in df.itertuples(index=False, name=None):
+        row_parts = []
+        for col, raw_value in zip(columns, row):
+            value = str(raw_value).strip()
+            if value and value != 'nan' and value != 'None':
+                row_parts.append(f"{col}: {value}")
+        
+        if row_parts:
+            yield ", ".join(row_parts)
+
 
-def _process_file_content(file_extension, file_content):
+def _process_file_content(file_extension, file_content, stream_rows=False):
     if file_extension == 'pdf':
         logger.info("📄 Processing PDF file...")
         pdf_reader = PdfReader(BytesIO(file_content))
@@ -38,18 +81,12 @@ def _process_file_content(file_extension, file_content):
         df = df.reset_index(drop=True)
         logger.info(f"📊 Cleaned DataFrame shape: {df.shape}")
     
+        if stream_rows:
+            logger.info("📊 Streaming Excel rows as individual chunks")
+            return {"type": "excel", "chunks": iter_excel_rows(df)}
+
         try:
-            structured_rows = []
-            for index, row in df.iterrows():
-                row_parts = []
-                for col in df.columns:
-                    value = str(row[col]).strip()
-                    if value and value != 'nan' and value != 'None':
-                        row_parts.append(f"{col}: {value}")
-                
-                if row_parts:
-                    row_text = ", ".join(row_parts)
-                    structured_rows.append(row_text)
+            structured_rows = list(iter_excel_rows(df))
             
             logger.info(f"📊 Processed {len(structured_rows)} meaningful Excel rows as individual chunks")
             
@@ -78,15 +115,39 @@ def _process_file_content(file_extension, file_content):
         raise ValueError(f"❌ File format not supported: {file_extension}")
 
 
-def read_document_from_s3(bucket_name, file_key):
-    try:
-        logger.info(
-            f"📂 Downloading the {file_key} file from the bucket {bucket_name}...")
+def _download_object(bucket_name, file_key, etag=None):
+    logger.info(
+        f"📂 Downloading the {file_key} file from the bucket {bucket_name}...")
+    if etag is None:
         response = s3_client.get_object(Bucket=bucket_name, Key=file_key)
-        file_content = response['Body'].read()
+    else:
+        response = s3_client.get_object(Bucket=bucket_name, Key=file_key, IfMatch=etag)
+    return response['Body'].read()
+
+
+_download_object_cached = lru_cache(maxsize=S3_OBJECT_CACHE_SIZE)(_download_object)
+
+
+def read_document_from_s3(bucket_name, file_key, stream_rows=False, cache=False):
+    """
+    Download and parse a document from S3.
+
+    With cache, the object body is cached by ETag (checked with a cheap
+    HeadObject), so reading the same unchanged file again skips the download.
+    Meant for the reference files; other documents are downloaded directly.
+
+    With stream_rows, Excel rows are returned as a lazy generator under "chunks"
+    instead of a list, so callers that consume them once don't hold every row.
+    """
+    try:
+        if cache:
+            etag = s3_client.head_object(Bucket=bucket_name, Key=file_key)['ETag']
+            file_content = _download_object_cached(bucket_name, file_key, etag)
+        else:
+            file_content = _download_object(bucket_name, file_key)
         file_extension = file_key.lower().split('.')[-1]
 
-        return _process_file_content(file_extension, file_content)
+        return _process_file_content(file_extension, file_content, stream_rows)
 
     except Exception as e:
         logger.error(
@@ -105,7 +166,8 @@ def upload_file_to_s3(file_content, bucket_name, file_key, content_type=None):
         content_type: Optional MIME type of the file
 
     Returns:
-        dict: The response from S3 upload operation
+        dict: The response from S3 upload operation (None for file-like objects,
+        which are streamed with a managed multipart upload)
 
     Raises:
         Exception: If the upload fails
@@ -113,6 +175,15 @@ def upload_file_to_s3(file_content, bucket_name, file_key, content_type=None):
     try:
         logger.info(f"📤 Uploading file to {bucket_name}/{file_key}...")
 
+        if hasattr(file_content, "read"):
+            extra_args = {'ContentType': content_type} if content_type else None
+            s3_client.upload_fileobj(
+                file_content, bucket_name, file_key,
+                ExtraArgs=extra_args, Config=UPLOAD_TRANSFER_CONFIG)
+            logger.info(
+                f"✅ File successfully uploaded to {bucket_name}/{file_key}")
+            return None
+
         # Prepare upload parameters
         upload_args = {
             'Bucket': bucket_name,
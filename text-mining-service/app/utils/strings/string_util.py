@@ -0,0 +1,12 @@
+import re
+import unicodedata
+
+_FILENAME_DISALLOWED_RE = re.compile(r'[^a-z0-9_\-.]')
+_SPACE_TO_UNDERSCORE = str.maketrans(" ", "_")
+
+
+def normalize_filename(filename):
+    """ASCII, lower-case, underscores for spaces and only [a-z0-9_-.] kept"""
+    filename = unicodedata.normalize('NFKD', filename).encode('ASCII', 'ignore').decode('utf-8')
+    filename = filename.lower().translate(_SPACE_TO_UNDERSCORE)
+    return _FILENAME_DISALLOWED_RE.sub('', filename)
@@ -0,0 +1,27 @@
+from app.utils.logger.logger_util import get_logger
+
+logger = get_logger()
+
+
+def estimate_tokens(text):
+    """Cheap token estimate (~4 characters per token)"""
+    return len(text) // 4 + 1
+
+
+def fit_token_budget(chunks, max_tokens):
+    """
+    Keep chunks, in the given (relevance) order, until max_tokens is reached.
+    The first chunk is always kept so the prompt never loses all document context.
+    """
+    kept = []
+    used = 0
+    for chunk in chunks:
+        chunk_tokens = estimate_tokens(chunk)
+        if kept and used + chunk_tokens > max_tokens:
+            break
+        kept.append(chunk)
+        used += chunk_tokens
+
+    if len(kept) < len(chunks):
+        logger.info(f"✂️ Using {len(kept)} of {len(chunks)} relevant chunks (~{used} tokens) to fit the context budget")
+    return kept
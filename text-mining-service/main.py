@@ -4,4 +4,7 @@ load_dotenv()
 
 from app.mcp.client import app
 
-handler = Mangum(app)
\ No newline at end of file
+# Mangum would run the lifespan (starting and stopping the MCP server) on every
+# invocation; the session is started lazily by the first request instead and
+# kept for the life of the warm environment
+handler = Mangum(app, lifespan="off")
\ No newline at end of file